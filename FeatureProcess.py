@@ -5,14 +5,26 @@ import re
 import os
 import json
 import warnings
+from bisect import bisect_right
 from tqdm import tqdm
 
 from sklearn import preprocessing
 from scipy import stats
+from scipy.sparse import csc_matrix
 
 from WoeMethods import AllWoeFuncs, WoeFuncs
 import tools
 
+def _cap_array(vals, floor, up):
+    """
+    vals：二维数组，每列一个特征；floor、up：与列对齐的上下限数组，None/nan表示不截断
+    与逐个元素min(b, max(x, s))的结果一致：上下限均设定时空值取上限，否则空值保持为空
+    """
+    floor = np.where(np.isnan(floor), -np.inf, floor)
+    up = np.where(np.isnan(up), np.inf, up)
+    both = np.isfinite(floor) & np.isfinite(up)
+    return np.where(np.isnan(vals) & both, up, np.clip(vals, floor, up))
+
 class undoMethods(object):
     def __init__(self):
         pass
@@ -45,9 +57,9 @@ class putNaMethods(object):
             pass
         
         if len(list(self.na_dict.keys()))>0 and self.ft_name in list(self.na_dict.keys()):
-            df = df.assign(**{self.ft_name:df[self.ft_name].apply(lambda x: np.nan if x in self.na_dict[self.ft_name].values() else x)})  
+            df = df.assign(**{self.ft_name:df[self.ft_name].mask(df[self.ft_name].isin(list(self.na_dict[self.ft_name].values())))})
         elif len(self.na_list)>0:
-            df = df.assign(**{self.ft_name:df[self.ft_name].apply(lambda x: np.nan if x in self.na_list else x)})
+            df = df.assign(**{self.ft_name:df[self.ft_name].mask(df[self.ft_name].isin(self.na_list))})
         else:
             warnings.warn('Attention: no treat in %s'%self.ft_name)
         return df
@@ -59,7 +71,7 @@ class fillMethods(object):
     def fit(self, df):
         self.ft_name = df.columns.values[0]
         if self.tgtM in ['mean', 'median', 'min', 'max']:
-            tgt_v = eval('df[self.ft_name].%s()'%(self.tgtM))
+            tgt_v = getattr(df[self.ft_name], self.tgtM)()
         elif isinstance(self.tgtM, str):
             warnings.warn('str value input for missing fulfill, please check!')
             tgt_v = self.tgtM
@@ -85,16 +97,6 @@ class capMethods(object):
         self.max_pct = param.get('max_pct')
         self.min_pct = param.get('min_pct')
         
-    def _subcapMethods(self, x, s, b):
-        if s is None and b is None:
-            return x
-        elif s is None and b is not None:
-            return min(x, b)
-        elif s is not None and b is None:
-            return max(x, s)
-        else:
-            return min(b, max(x, s))
-        
     def fit(self, df):
         self.ft_name = df.columns.values[0]
         if (self.up is None) and (self.max_pct is not None):
@@ -116,13 +118,93 @@ class capMethods(object):
         if (self.up is None) and (self.floor is None):
             warnings.warn('Function dose not actually run')
         try:
-            df = df.assign(**{self.ft_name:df[self.ft_name].apply(self._subcapMethods, s = self.floorV, b = self.upV)})
+            ft_name = self.ft_name
+            vals = df[ft_name].values
         except KeyError:
             warnings.warn('Attention: %s No matched features' %self.ft_name)
             ft_name = df.columns.values[0]
-            df = df.assign(**{ft_name:df[ft_name].apply(self._subcapMethods, s = self.floorV, b = self.upV)})
+            vals = df[ft_name].values
+        vals = _cap_array(vals.astype(float)[:, None], np.array([self.floorV], dtype = float), np.array([self.upV], dtype = float))
+        df = df.assign(**{ft_name:vals[:, 0]})
         return df
     
+class fillBlockMethods(object):
+    """
+    对一组特征整块进行缺失值填充，param为{特征名:填充方式}
+    mean/median/min/max按列块一次计算，填充值以与ft_names对齐的数组保存
+    """
+    def __init__(self, param):
+        self.tgtM = param
+
+    def fit(self, df):
+        self.ft_names = np.array([f for f in self.tgtM.keys() if f in df.columns], dtype = object)
+        tgt_v = pd.Series(np.nan, index = self.ft_names, dtype = object)
+        for m in ['mean', 'median', 'min', 'max']:
+            cols = [f for f in self.ft_names if self.tgtM[f] == m]
+            if len(cols) > 0:
+                tgt_v[cols] = getattr(df[cols], m)().values
+        for f in self.ft_names:
+            if self.tgtM[f] not in ['mean', 'median', 'min', 'max']:
+                if isinstance(self.tgtM[f], str):
+                    warnings.warn('str value input for missing fulfill, please check!')
+                tgt_v[f] = self.tgtM[f]
+
+        try:
+            self.tgtV = tgt_v.values.astype(float)
+        except (TypeError, ValueError):
+            self.tgtV = tgt_v.values
+        self.loc = {f:i for i, f in enumerate(self.ft_names)}
+        return self
+
+    def transform(self, df):
+        cols = [f for f in self.ft_names if f in df.columns]
+        if len(cols) < df.shape[1]:
+            warnings.warn('Attention: %s No matched features' %(','.join([str(f) for f in df.columns if f not in self.loc])))
+        tgt_v = self.tgtV[[self.loc[f] for f in cols]]
+        if tgt_v.dtype == object:
+            return df.assign(**df[cols].fillna(dict(zip(cols, tgt_v))))
+        vals = df[cols].values.astype(float)
+        return df.assign(**dict(zip(cols, np.where(np.isnan(vals), tgt_v, vals).T)))
+
+class capBlockMethods(object):
+    """
+    对一组特征整块进行截断，param为{特征名:{'up','floor','max_pct','min_pct'}}
+    分位数按列块一次计算，上下限以与ft_names对齐的数组保存，未设定为nan
+    """
+    def __init__(self, param):
+        self.param = param
+
+    def fit(self, df):
+        self.ft_names = np.array([f for f in self.param.keys() if f in df.columns], dtype = object)
+        def _bound(k, pk):
+            v = np.array([np.nan if self.param[f].get(k) is None else self.param[f].get(k) for f in self.ft_names], dtype = float)
+            p = np.array([np.nan if self.param[f].get(pk) is None else self.param[f].get(pk) for f in self.ft_names], dtype = float)
+            return v, np.isnan(v) & ~np.isnan(p), p
+        up, up_q, up_p = _bound('up', 'max_pct')
+        floor, floor_q, floor_p = _bound('floor', 'min_pct')
+
+        q_cols = np.flatnonzero(up_q | floor_q)
+        if len(q_cols) > 0:
+            pcts = np.unique(np.concatenate([up_p[up_q], floor_p[floor_q]]))
+            qs = df[list(self.ft_names[q_cols])].quantile(pcts).values
+            pos = {c:i for i, c in enumerate(q_cols)}
+            for bound, ifq, p in [(up, up_q, up_p), (floor, floor_q, floor_p)]:
+                idx = np.flatnonzero(ifq)
+                bound[idx] = qs[np.searchsorted(pcts, p[idx]), [pos[c] for c in idx]]
+
+        self.upV = up
+        self.floorV = floor
+        self.loc = {f:i for i, f in enumerate(self.ft_names)}
+        return self
+
+    def transform(self, df):
+        cols = [f for f in self.ft_names if f in df.columns]
+        if len(cols) < df.shape[1]:
+            warnings.warn('Attention: %s No matched features' %(','.join([str(f) for f in df.columns if f not in self.loc])))
+        idx = [self.loc[f] for f in cols]
+        vals = _cap_array(df[cols].values.astype(float), self.floorV[idx], self.upV[idx])
+        return df.assign(**dict(zip(cols, vals.T)))
+
 class onehotMethods(object):
     def __init__(self, param):
         self.value_range = param.get('value_range')
@@ -137,19 +219,47 @@ class onehotMethods(object):
             
         return self
     
-    def transform(self, df):
+    def _codes(self, df):
+        """
+        返回各类别对应的列名及每个样本的类别位置（-1表示该样本所有列均为0），与pd.get_dummies一致：
+        不在value_rangeV中的取值视为空值，无空值时去掉第一个类别
+        """
         try:
             ft_name = self.ft_name
-            df = df.assign(**{ft_name:df[ft_name].apply(lambda x: x if x in self.value_rangeV else None)})
+            s = df[ft_name]
         except KeyError:
             warnings.warn('Attention: %s No matched features' %self.ft_name)
             ft_name = df.columns.values[0]
-            df = df.assign(**{ft_name:df[ft_name].apply(lambda x: x if x in self.value_rangeV else None)})
-             
-        if df[ft_name].isna().max() == 1:
-            return pd.get_dummies(df[ft_name], prefix = ft_name, dummy_na = False).astype(object).astype(int)
-        else:
-            return pd.get_dummies(df[ft_name], prefix = ft_name, drop_first = True).astype(object).astype(int)
+            s = df[ft_name]
+
+        cat = pd.Categorical(s.where(s.isin(self.value_rangeV)))
+        codes = cat.codes.astype(np.int64)
+        names = [ft_name+'_'+str(a) for a in cat.categories]
+        if not (codes < 0).any():
+            names = names[1:]
+            codes = codes - 1
+        return names, codes
+
+    def _sparse_frame(self, names, codes, index, dtype = int):
+        """
+        由类别位置构建稀疏（pd.SparseDtype，填充值为0）的哑变量DataFrame，只保存取值为1的位置
+        """
+        rows = np.flatnonzero(codes >= 0)
+        mat = csc_matrix((np.ones(len(rows), dtype = np.int8), (rows, codes[rows])), shape = (len(index), len(names)))
+        #浮点类型的稀疏矩阵转换后填充值为nan，先以整型构建再转换类型以保持填充值为0
+        return pd.DataFrame.sparse.from_spmatrix(mat, index = index, columns = names).astype(pd.SparseDtype(dtype, 0))
+
+    def transform(self, df, sparse = False):
+        """
+        sparse：是否返回稀疏类型的哑变量，类别较多时可大幅减少内存占用
+        """
+        names, codes = self._codes(df)
+        if sparse:
+            return self._sparse_frame(names, codes, df.index)
+        dummies = np.zeros((len(df), len(names)), dtype = int)
+        rows = np.flatnonzero(codes >= 0)
+        dummies[rows, codes[rows]] = 1
+        return pd.DataFrame(dummies, index = df.index, columns = names)
         
 class setStrMethods(object):
     def __init__(self, param):
@@ -161,7 +271,7 @@ class setStrMethods(object):
     
     def transform(self, df):
         try:
-            df = df.assign(**{self.ft_name:df[self.ft_name].apply(lambda x: self.strs2orders[x] if x in self.strs2orders.keys() else None)})
+            df = df.assign(**{self.ft_name:tools.dict_map(df[self.ft_name], self.strs2orders)})
             if df[self.ft_name].isna().sum() >= 1:
                 if 'nan' in self.strs2orders.keys():
                     df = df.fillna(self.strs2orders['nan'])
@@ -171,7 +281,7 @@ class setStrMethods(object):
         except:
             warnings.warn('Attention: %s No matched features' %self.ft_name)
             ft_name = df.columns.values[0]
-            df = df.assign(**{ft_name:df[ft_name].apply(lambda x: self.strs2orders[x] if x in self.strs2orders.keys() else self.strs2orders['nan'])})
+            df = df.assign(**{ft_name:tools.dict_map(df[ft_name], self.strs2orders, self.strs2orders['nan'])})
             if df[ft_name].isna().sum() >= 1:
                 if 'nan' in self.strs2orders.keys():
                     df = df.fillna(self.strs2orders['nan'])
@@ -187,6 +297,7 @@ class woeMethods(WoeFuncs):
         self.bins = param.get('bins')
         self.woes = param.get('woes')            
         self.type_info = param.get('type_info')
+        self.fast = param.get('fast', False)
         
     def fit(self, df):
         #self.ft_name = df.columns.values[0]
@@ -208,17 +319,22 @@ class woeMethods(WoeFuncs):
             
         return self
     
-    def transform(self, df):
+    def transform(self, df, fast = None):
+        """
+        fast：是否使用向量化的WOE编码，默认沿用初始化参数
+        """
+        if fast is None:
+            fast = self.fast
         self.setTgt(df)
         if isinstance(self.woeDetail[self.ft_name].get('str2orders'), dict):
             self._setStrValue(self.woeDetail[self.ft_name]['str2orders'], ifraise = False)
-            self.woe_apply(keepnan = self.keepnan)
+            self.woe_apply(keepnan = self.keepnan, fast = fast)
             
         elif isinstance(self.woeDetail[self.ft_name]['bins'], dict):
             self.strWoe_apply(keepnan = self.keepnan)
             
         else:
-            self.woe_apply(keepnan = self.keepnan)
+            self.woe_apply(keepnan = self.keepnan, fast = fast)
             
         mdf = self.getWoeCode()
         self.freeMmy()
@@ -286,7 +402,7 @@ class AllFtrProcess(object):
         }
     }
     """
-    def __init__(self, path, pct_size = 0.03, max_grps = 5, chiq_pv = 0.05, ifmono = True, keepnan = True, methods = 'tree'):
+    def __init__(self, path, pct_size = 0.03, max_grps = 5, chiq_pv = 0.05, ifmono = True, keepnan = True, methods = 'tree', fast = False):
         self.params = {}
         self.params['pct_size'] = pct_size
         self.params['max_grps'] = max_grps
@@ -294,6 +410,7 @@ class AllFtrProcess(object):
         self.params['ifmono'] = ifmono
         self.params['keepnan'] = keepnan
         self.params['methods'] = methods
+        self.params['fast'] = fast
         
         if isinstance(path, dict):
             smy = path
@@ -306,19 +423,30 @@ class AllFtrProcess(object):
         self.onehot_list = smy['onehot']
         self.woe_list = smy['woeCal']
         
-    def fit(self, data):
+    def fit(self, data, block = False):
         """
         此方法每一个特征只能进行一次处理；
         若想顺序调整则需要重写fit
+        block：fill和cap特征是否整块拟合，同组特征共用一个fillBlockMethods/capBlockMethods
         """
         all_methods = {}
-        for k,v in self.fill_list.items():
-            if k in data.columns:
-                all_methods[k] = fillMethods(v).fit(data[[k]])
+        if block:
+            fill_m = fillBlockMethods(self.fill_list).fit(data)
+            for k in fill_m.ft_names:
+                all_methods[k] = fill_m
+        else:
+            for k,v in self.fill_list.items():
+                if k in data.columns:
+                    all_methods[k] = fillMethods(v).fit(data[[k]])
             
-        for k,v in self.cap_list.items():
-            if k in data.columns:
-                all_methods[k] = capMethods(v).fit(data[[k]])
+        if block:
+            cap_m = capBlockMethods(self.cap_list).fit(data)
+            for k in cap_m.ft_names:
+                all_methods[k] = cap_m
+        else:
+            for k,v in self.cap_list.items():
+                if k in data.columns:
+                    all_methods[k] = capMethods(v).fit(data[[k]])
             
         for k,v in self.var2char_list.items():
             if k in data.columns:
@@ -340,7 +468,124 @@ class AllFtrProcess(object):
         self.all_methods = all_methods
         return self
             
-    def transform(self, data, iflabel = True):
+    def _transform_plan(self):
+        """
+        按处理方式对特征分组，并记录各特征在输出中的顺序，供transform的fused模式使用
+        输出列顺序与逐个特征处理时一致：undo特征，非onehot特征（label），最后为onehot展开后的列
+        """
+        groups = {'fill':[], 'cap':[], 'var2char':[], 'woe':[], 'onehot':[]}
+        types = [((fillMethods, fillBlockMethods), 'fill'), ((capMethods, capBlockMethods), 'cap'), (setStrMethods, 'var2char'), (woeMethods, 'woe'), (onehotMethods, 'onehot')]
+        for f, m in self.all_methods.items():
+            for c, g in types:
+                if isinstance(m, c):
+                    groups[g] += [f]
+                    break
+        return groups
+
+    def _aligned_param(self, ftrs, attr):
+        """
+        取各特征拟合得到的参数，整块拟合的方法按位置取对齐数组中的值
+        """
+        rlt = []
+        for f in ftrs:
+            m = self.all_methods[f]
+            v = getattr(m, attr)
+            rlt += [v[m.loc[f]] if isinstance(m, (fillBlockMethods, capBlockMethods)) else v]
+        return np.array([np.nan if v is None else v for v in rlt], dtype = float)
+
+    def _fused_fill(self, data, ftrs):
+        vals = data[ftrs].values.astype(float)
+        return np.where(np.isnan(vals), self._aligned_param(ftrs, 'tgtV'), vals)
+
+    def _fused_cap(self, data, ftrs):
+        vals = data[ftrs].values.astype(float)
+        return _cap_array(vals, self._aligned_param(ftrs, 'floorV'), self._aligned_param(ftrs, 'upV'))
+
+    def _fused_var2char(self, data, f):
+        d = self.all_methods[f].strs2orders
+        vals = tools.dict_map(data[f], d, d.get('nan')).values.astype(float)
+        if 'nan' not in d.keys() and np.isnan(vals).any():
+            warnings.warn('Attention: setStrMethods Nan value happend!')
+        return vals
+
+    def _fused_woe(self, data, f):
+        m = self.all_methods[f]
+        detail = m.woeDetail[f]
+        bins, woes = detail['bins'], detail['woes']
+        if isinstance(detail.get('str2orders'), dict):
+            vals = tools.dict_map(data[f], detail['str2orders']).values.astype(float)
+        elif isinstance(bins, dict):
+            #定性特征：未见过的类别使用‘nan’分组的WOE，与strWoe_apply一致，keepnan时空值样本保持为空
+            s = data[f]
+            known = s.isin(list(bins.keys()))
+            unknown = ~known & s.notna() if m.keepnan else ~known
+            if unknown.any() and 'nan' not in woes.keys():
+                raise KeyError('nan value happened in test!')
+            codes = s.where(known).map(woes).values.astype(float)
+            codes[unknown.values] = woes.get('nan', np.nan)
+            return codes
+        else:
+            vals = data[f].values.astype(float)
+
+        codes = m._woe_codes(vals, bins, woes)
+        if not m.keepnan:
+            codes[np.isnan(vals)] = np.nan
+        return codes
+
+    def _fused_onehot(self, data, f):
+        return self.all_methods[f]._codes(data[[f]])
+
+    def _transform_fused(self, data, iflabel = True, dtype = np.float64, sparse = False):
+        """
+        按处理方式分组，对同一组的特征整块进行向量化处理，结果写入一次性预分配的数组
+        undo特征及label保持原有类型，单独插入；sparse时onehot列不写入数组，单独构建一个稀疏块拼接在最后
+        """
+        groups = self._transform_plan()
+        onehots = groups['onehot']
+        base = self.undo_list + [f for f in self.all_methods.keys() if f not in onehots] + (['label'] if iflabel else [])
+        dummies = {f:self._fused_onehot(data, f) for f in onehots}
+        columns = base + sum([dummies[f][0] for f in onehots], [])
+
+        #只有经过处理的特征写入数组，undo特征及label之后按位置插入
+        inserts = [(i, f) for i, f in enumerate(base) if f in self.undo_list or f == 'label']
+        blk_cols = [f for i, f in enumerate(columns[:len(base)] if sparse else columns) if i not in dict(inserts).keys()]
+        loc = {f:j for j, f in enumerate(blk_cols)}
+        out = np.empty((len(data), len(blk_cols)), dtype = dtype)
+
+        if len(groups['fill']) > 0:
+            out[:, [loc[f] for f in groups['fill']]] = self._fused_fill(data, groups['fill'])
+        if len(groups['cap']) > 0:
+            out[:, [loc[f] for f in groups['cap']]] = self._fused_cap(data, groups['cap'])
+        for f in groups['var2char']:
+            out[:, loc[f]] = self._fused_var2char(data, f)
+        for f in groups['woe']:
+            out[:, loc[f]] = self._fused_woe(data, f)
+        for f in (onehots if not sparse else []):
+            names, codes = dummies[f]
+            if len(names) == 0:
+                continue
+            start = loc[names[0]]
+            out[:, start:start+len(names)] = 0
+            rows = np.flatnonzero(codes >= 0)
+            out[rows, start + codes[rows]] = 1
+
+        rlt = pd.DataFrame(out, index = data.index, columns = blk_cols)
+        for i, f in inserts:
+            rlt.insert(i, f, data[f].values)
+
+        if sparse and len(columns) > len(base):
+            rlt = pd.concat([rlt] + [self.all_methods[f]._sparse_frame(*dummies[f], data.index, dtype) for f in onehots], axis = 1)
+        return rlt
+
+    def transform(self, data, iflabel = True, fused = False, dtype = np.float64, sparse = False):
+        """
+        fused：是否按处理方式整块向量化处理，输出一次性写入预分配的数组，列顺序与逐个特征处理一致，
+        数值均为dtype类型（onehot列不再是int）
+        sparse：onehot列是否输出为稀疏类型（pd.SparseDtype），可直接用于xgbModel，lrModel拟合时会转换为稠密
+        """
+        if fused:
+            return self._transform_fused(data, iflabel, dtype, sparse)
+
         all_ftrs = self.undo_list + list(self.all_methods.keys())
         if iflabel:
             data = data[all_ftrs+['label']]
@@ -352,7 +597,7 @@ class AllFtrProcess(object):
                     #print(f)
                     if f in data.columns:
                         if f in self.onehot_list.keys():
-                            data = pd.merge(left = data, right = m.transform(data[[f]]), right_index = True, left_index = True, how = 'left')
+                            data = pd.merge(left = data, right = m.transform(data[[f]], sparse = sparse), right_index = True, left_index = True, how = 'left')
                         else:
                             data = data.assign(**{f:m.transform(data[[f]])})
         except KeyboardInterrupt:
@@ -367,3 +612,194 @@ class AllFtrProcess(object):
             
         return data
     
+class scoreCardPipeline(object):
+    """
+    由拟合好的AllFtrProcess与逻辑回归模型（lrModel）生成的评分卡，将特征处理、模型预测与tools.card_score合并为一步：
+    score = A - B*log(good_weight) + B*const + sum(B*coef*x)，每个特征的得分只与该特征取值有关，
+    因此预先计算各特征取值（分组）对应的分数：
+        linear：undo/fill/cap特征，得分为B*coef乘以处理后的取值
+        bins：数值型WOE特征，searchsorted定位分组后取对应的分数
+        maps：var2char/字符型WOE/onehot等按取值查表的特征，以[取值, 分数]列表保存
+    card：可直接传入toJson导出的评分卡，此时不需要process及model
+    """
+    def __init__(self, process = None, model = None, P = 660, Q = 20, PDO = 50, good_weight = 1, card = None):
+        if card is None:
+            card = self._build(process, model, P, Q, PDO, good_weight)
+        self.card = card
+        self._compile()
+
+    def _build(self, process, model, P, Q, PDO, good_weight):
+        if not hasattr(model, 'getCoefs'):
+            raise TypeError('scoreCardPipeline: only linear model with getCoefs is supported')
+        coefs = model.getCoefs()
+        B = -PDO/np.log(2)
+        A = P + B*np.log(Q)
+        card = {'params':{'P':P, 'Q':Q, 'PDO':PDO, 'good_weight':good_weight},
+                'base':float(A - B*np.log(good_weight) + B*coefs.get('const', 0)),
+                'linear':{'ftrs':[], 'points':[], 'nanv':[], 'floor':[], 'up':[]}, 'bins':{}, 'maps':{}}
+        used = set()
+        ftrs = [f for f in coefs.index if f != 'const']
+
+        def _linear(f, bc, nanv = np.nan, floor = -np.inf, up = np.inf):
+            for k, v in zip(['ftrs', 'points', 'nanv', 'floor', 'up'], [f, bc, nanv, floor, up]):
+                card['linear'][k] += [v]
+
+        for f in process.undo_list:
+            if f in ftrs:
+                _linear(f, B*coefs[f])
+                used.add(f)
+
+        for f, m in process.all_methods.items():
+            if isinstance(m, onehotMethods):
+                cats = [(a, f+'_'+str(a)) for a in m.value_rangeV]
+                if any(c in ftrs for a, c in cats):
+                    card['maps'][f] = {'pairs':[[a, B*coefs[c] if c in ftrs else 0.0] for a, c in cats], 'default':0.0, 'nullv':0.0}
+                    used.update([c for a, c in cats])
+                continue
+            if f not in ftrs:
+                continue
+            used.add(f)
+            bc = B*coefs[f]
+            if isinstance(m, (fillMethods, fillBlockMethods)):
+                _linear(f, bc, nanv = float(process._aligned_param([f], 'tgtV')[0]))
+            elif isinstance(m, (capMethods, capBlockMethods)):
+                floor, up = process._aligned_param([f], 'floorV')[0], process._aligned_param([f], 'upV')[0]
+                #与_cap_array一致：上下限均设定时空值取上限
+                nanv = up if not (np.isnan(floor) or np.isnan(up)) else np.nan
+                _linear(f, bc, nanv, -np.inf if np.isnan(floor) else floor, np.inf if np.isnan(up) else up)
+            elif isinstance(m, setStrMethods):
+                d = m.strs2orders
+                v = bc*d['nan'] if 'nan' in d.keys() else np.nan
+                card['maps'][f] = {'pairs':[[k, bc*o] for k, o in d.items()], 'default':v, 'nullv':v}
+            elif isinstance(m, woeMethods):
+                card[self._woe_kind(m)][f] = self._woe_points(m, f, bc)
+
+        lost = [f for f in ftrs if f not in used]
+        if len(lost) > 0:
+            raise KeyError('scoreCardPipeline: %s not found in process'%(','.join(lost)))
+        return card
+
+    def _woe_kind(self, m):
+        detail = m.woeDetail[m.ft_name]
+        if isinstance(detail.get('str2orders'), dict) or isinstance(detail['bins'], dict):
+            return 'maps'
+        return 'bins'
+
+    def _woe_points(self, m, f, bc):
+        """
+        WOE特征各取值对应的分数，与AllFtrProcess.transform的结果保持一致，
+        default/nullv为None表示该取值在transform中会报错（未知类别且没有‘nan’分组）
+        """
+        detail = m.woeDetail[f]
+        bins, woes = detail['bins'], detail['woes']
+        if isinstance(detail.get('str2orders'), dict):
+            def _one(v):
+                try:
+                    code = m._woe_codes(np.array([v], dtype = float), bins, woes)[0]
+                except KeyError:
+                    return None
+                return np.nan if np.isnan(v) and not m.keepnan else bc*code
+            nullv = _one(np.nan)
+            return {'pairs':[[k, _one(o)] for k, o in detail['str2orders'].items()], 'default':nullv, 'nullv':nullv}
+        elif isinstance(bins, dict):
+            default = bc*woes['nan'] if 'nan' in woes.keys() else None
+            return {'pairs':[[k, bc*woes[k] if k in woes.keys() else np.nan] for k in bins.keys()],
+                    'default':default, 'nullv':np.nan if m.keepnan else default}
+        else:
+            cuts_arr, woes_arr, valid_arr = m._woe_arrays(bins, woes)
+            return {'cuts':list(cuts_arr), 'points':list(bc*np.where(valid_arr, woes_arr, 0)), 'valid':[bool(a) for a in valid_arr], 'keepnan':bool(m.keepnan)}
+
+    def _compile(self):
+        """
+        将评分卡整理为批量打分使用的数组，以及单条打分使用的python列表和字典
+        """
+        lin = self.card['linear']
+        self.base = self.card['base']
+        self.inputs = list(lin['ftrs']) + list(self.card['bins'].keys()) + list(self.card['maps'].keys())
+        self._lin_arr = {k:np.array(lin[k], dtype = float) for k in ['points', 'nanv', 'floor', 'up']}
+        self._bins_arr = {f:(np.array(b['cuts'], dtype = float), np.array(b['points'], dtype = float), np.array(b['valid'])) for f, b in self.card['bins'].items()}
+        self._maps_dict = {f:{k:v for k, v in mp['pairs']} for f, mp in self.card['maps'].items()}
+
+        self._lin_one = list(zip(lin['ftrs'], lin['points'], lin['nanv'], lin['floor'], lin['up']))
+        self._bins_one = [(f, b['cuts'], b['points'], b['valid'], b['keepnan']) for f, b in self.card['bins'].items()]
+        self._maps_one = [(f, self._maps_dict[f], mp['default'], mp['nullv']) for f, mp in self.card['maps'].items()]
+
+    def points(self, data):
+        """
+        批量计算各特征的分数，data为DataFrame，或列顺序与self.inputs一致的二维数组
+        返回与self.inputs对齐的分数数组
+        """
+        if not isinstance(data, pd.DataFrame):
+            data = pd.DataFrame(data, columns = self.inputs)
+        rlt = np.empty((len(data), len(self.inputs)), dtype = float)
+        k = len(self._lin_one)
+
+        if k > 0:
+            vals = data[self.card['linear']['ftrs']].values.astype(float)
+            vals = np.where(np.isnan(vals), self._lin_arr['nanv'], np.clip(vals, self._lin_arr['floor'], self._lin_arr['up']))
+            rlt[:, :k] = vals*self._lin_arr['points']
+
+        for j, (f, (cuts, pts, valid)) in enumerate(self._bins_arr.items()):
+            vals = data[f].values.astype(float)
+            grp = np.searchsorted(cuts, np.clip(np.where(np.isnan(vals), cuts[0], vals), cuts[0], cuts[-1]), side = 'right') - 1
+            if not valid[grp].all():
+                raise KeyError('nan value happened in test!')
+            rlt[:, k+j] = pts[grp]
+            if not self.card['bins'][f]['keepnan']:
+                rlt[np.isnan(vals), k+j] = np.nan
+
+        k += len(self._bins_arr)
+        for j, (f, d, default, nullv) in enumerate(self._maps_one):
+            s = data[f]
+            null, known = s.isna().values, s.isin(list(d.keys())).values
+            #分数为None的取值在transform中会报错
+            if (default is None and (~known & ~null).any()) or (nullv is None and null.any()) or s.isin([a for a, v in d.items() if v is None]).any():
+                raise KeyError('nan value happened in test!')
+            pts = tools.dict_map(s, d, default).values.astype(float)
+            pts[null] = nullv
+            rlt[:, k+j] = pts
+        return rlt
+
+    def score(self, data):
+        """
+        批量打分，结果与AllFtrProcess.transform -> lrModel.predict -> tools.card_score一致
+        """
+        return self.base + self.points(data).sum(axis = 1)
+
+    def score_one(self, row):
+        """
+        单条样本打分，row为{特征名:取值}的字典，只使用python内置类型运算以降低延迟
+        """
+        s = self.base
+        for f, bc, nanv, floor, up in self._lin_one:
+            v = row[f]
+            if v is None or v != v:
+                v = nanv
+            else:
+                v = min(max(v, floor), up)
+            s += bc*v
+
+        for f, cuts, pts, valid, keepnan in self._bins_one:
+            v = row[f]
+            isnan = v is None or v != v
+            if isnan and not keepnan:
+                return np.nan
+            v = cuts[0] if isnan else min(max(v, cuts[0]), cuts[-1])
+            g = bisect_right(cuts, v) - 1
+            if not valid[g]:
+                raise KeyError('nan value happened in test!')
+            s += pts[g]
+
+        for f, d, default, nullv in self._maps_one:
+            v = row[f]
+            p = nullv if v is None or v != v else d.get(v, default)
+            if p is None:
+                raise KeyError('nan value happened in test!')
+            s += p
+        return s
+
+    def toJson(self, path, file):
+        """
+        导出评分卡，之后可通过scoreCardPipeline(card = tools.getJson(...))加载
+        """
+        tools.putFile(path, file, self.card)
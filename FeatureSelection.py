@@ -1,9 +1,14 @@
 import pandas as pd
 import numpy as np
 
+import os
 import re
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import deepcopy
 from scipy import stats
+from scipy import linalg
 from statsmodels.stats.outliers_influence import variance_inflation_factor
 import statsmodels.api as sm
 import xgboost as xgb
@@ -23,6 +28,230 @@ else:
     from sklearn.cross_validation import train_test_split
 
 
+#子进程中共享的ModelBasedMethods对象，由进程池的initializer设置
+_shared_mbm = None
+
+def _oneStep_init(mbm):
+    """
+    进程池子进程的初始化：fork方式下直接继承父进程内存中的对象，不做序列化；
+    spawn等其他方式下每个子进程只传递一次
+    """
+    global _shared_mbm
+    _shared_mbm = mbm
+
+def _oneStep_worker(ftrs, modeltype, rnd_seed, test_size, eval_s, mtrc, tgt):
+    """
+    子进程任务：在共享的特征矩阵上拟合一个候选特征组合，返回模型表现及tgt的t值
+    """
+    _shared_mbm.featureStat_model(ftrs, modeltype, rnd_seed, test_size = test_size)
+    tvl = _shared_mbm.model_.getTvalues()[tgt] if tgt is not None else None
+    return _shared_mbm.model_perform_[eval_s][mtrc], tvl
+
+def _experiment_worker(ftrs, modeltype, rnd_seed, importance_type, params):
+    """
+    子进程任务：随机特征组合实验中的一次建模，返回训练集及测试集AUC和特征重要性
+    params：按进程数分配线程后的模型参数
+    """
+    _shared_mbm.params = params
+    _shared_mbm.featureStat_model(ftrs, modeltype, rnd_seed)
+    imp = _shared_mbm.getTvalues(importance_type, ifabs = True)['fscore']
+    perf = _shared_mbm.model_perform_
+    return perf['train']['auc'], perf['test']['auc'], imp
+
+def _auc_rank(label, score):
+    """
+    基于秩计算AUC，score可以为(n, m)的数组，按列分别计算；取值相同的样本取平均秩
+    """
+    ranks = stats.rankdata(score, axis = 0)
+    n_bad = label.sum(); n_good = len(label) - n_bad
+    return (label @ ranks - n_bad*(n_bad+1)/2.0)/(n_bad*n_good)
+
+class logitStepwise(object):
+    """
+    docstring for logitStepwise:
+    保留基础逻辑回归模型的Newton/IRLS状态（系数、Fisher信息及其Cholesky分解），
+    在此基础上近似评估加入或删除单个特征的效果，不需要对每个候选特征重新拟合
+    1.加入特征：score检验统计量，以及一步Newton更新后的近似系数与AUC；
+    2.删除特征：Wald检验统计量，以及受约束的一步更新后的近似AUC；
+    与lrModel一致，不使用样本权重
+    """
+    def __init__(self, x, y, x_eval = None, y_eval = None, ifconst = True, block = 256):
+        self.x = x
+        self.y = np.asarray(y, dtype = float)
+        self.x_eval = x_eval
+        self.y_eval = None if y_eval is None else np.asarray(y_eval, dtype = float)
+        self.ifconst = ifconst
+        self.block = block
+        self.base_ftrs = []
+        self.coef_ = np.zeros(1 if ifconst else 0)
+
+    def _design(self, x, ftrs):
+        xb = x[ftrs].values.astype(float)
+        if self.ifconst:
+            xb = np.hstack([np.ones((len(x), 1)), xb])
+        return xb
+
+    def fit(self, base_ftrs, max_iter = 35, tol = 1e-8):
+        """
+        用Newton法（IRLS）拟合基础模型，已有特征的系数作为初始值
+        """
+        old = dict(zip((['const'] if self.ifconst else []) + self.base_ftrs, self.coef_))
+        names = (['const'] if self.ifconst else []) + list(base_ftrs)
+        beta = np.array([old.get(i, 0.0) for i in names])
+        xb = self._design(self.x, base_ftrs)
+
+        for _ in range(max_iter + 1):
+            eta = xb @ beta
+            p = 1.0/(1.0 + np.exp(-eta))
+            w = p*(1-p)
+            if xb.shape[1] == 0:
+                break
+            info = xb.T @ (w[:, None]*xb)
+            chol = linalg.cho_factor(info, lower = True)
+            step = linalg.cho_solve(chol, xb.T @ (self.y - p))
+            if np.abs(step).max() < tol:
+                break
+            beta = beta + step
+        else:
+            warnings.warn('logitStepwise: Newton iterations did not converge')
+
+        self.base_ftrs = list(base_ftrs)
+        self.coef_ = beta
+        self.xb_ = xb; self.eta_ = eta; self.p_ = p; self.w_ = w
+        self.chol_ = chol if xb.shape[1] > 0 else None
+        return self
+
+    def _eval_set(self, eval_s):
+        if eval_s == 'train':
+            return self.x, self.y, self.eta_
+        if self.x_eval is None:
+            raise ValueError('no evaluation data provided')
+        return self.x_eval, self.y_eval, self._design(self.x_eval, self.base_ftrs) @ self.coef_
+
+    def score_plus(self, tgts, eval_s = 'train', ifauc = True):
+        """
+        对tgts中每个特征，在基础模型上计算score检验统计量（近似t值 = U/sqrt(V)）
+        ifauc为True时同时计算一步Newton更新后的近似AUC
+        返回三个以特征名为key的字典：score统计量，近似t值，近似AUC
+        """
+        resid = self.y - self.p_
+        x_e, y_e, eta_e = self._eval_set(eval_s)
+        xb_e = self._design(x_e, self.base_ftrs) if ifauc else None
+        scores, tvls, aucs = {}, {}, {}
+        for s in range(0, len(tgts), self.block):
+            names = list(tgts[s:s+self.block])
+            xc = self.x[names].values.astype(float)
+            wxc = self.w_[:, None]*xc
+            u = xc.T @ resid
+            var = (wxc*xc).sum(axis = 0)
+            if self.chol_ is not None:
+                ibc = self.xb_.T @ wxc
+                v = linalg.solve_triangular(self.chol_[0], ibc, lower = True)
+                var = var - (v**2).sum(axis = 0)
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                stat = u**2/var
+                z = u/np.sqrt(var)
+            scores.update(zip(names, stat.tolist())); tvls.update(zip(names, z.tolist()))
+
+            if ifauc:
+                #一步Newton：新特征系数为U/V，基础系数随之调整 -I_bb^{-1}I_bc * bc
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    bc = np.where(var > 0, u/var, 0)
+                eta_new = eta_e[:, None] + x_e[names].values.astype(float)*bc
+                if self.chol_ is not None:
+                    eta_new -= xb_e @ (linalg.cho_solve(self.chol_, ibc)*bc)
+                aucs.update(zip(names, _auc_rank(y_e, eta_new).tolist()))
+
+        return scores, tvls, aucs
+
+    def score_minus(self, eval_s = 'train', ifauc = True):
+        """
+        对基础模型中的每个特征（常数项除外），计算Wald检验统计量，
+        ifauc为True时计算删除该特征并做受约束的一步更新后的近似AUC
+        返回两个以特征名为key的字典：Wald统计量，近似AUC
+        """
+        cov = linalg.cho_solve(self.chol_, np.eye(len(self.coef_)))
+        ofs = 1 if self.ifconst else 0
+        idx = np.arange(ofs, len(self.coef_))
+        stat = self.coef_[idx]**2/cov[idx, idx]
+        walds = dict(zip(self.base_ftrs, stat.tolist()))
+        aucs = {}
+        if ifauc:
+            x_e, y_e, eta_e = self._eval_set(eval_s)
+            xb_e = self._design(x_e, self.base_ftrs)
+            delta = cov[:, idx]*(self.coef_[idx]/cov[idx, idx])
+            aucs = dict(zip(self.base_ftrs, _auc_rank(y_e, eta_e[:, None] - xb_e @ delta).tolist()))
+        return walds, aucs
+
+
+class corrCache(object):
+    """
+    docstring for corrCache:
+    按需计算特征间的相关系数（与DataFrame.corr一致，空值按成对删除处理），
+    每次只计算用到的特征与全部特征的相关系数，按block_size分块计算并缓存
+    """
+    def __init__(self, data, block_size = 256):
+        self.columns = list(data.columns.values)
+        self.index = pd.Index(self.columns)
+        self.block_size = block_size
+        x = data.values.astype(float)
+        nan = np.isnan(x)
+        self.ifnan_ = nan.any()
+        if self.ifnan_:
+            #空值置0后原地保存，非空标记以float32保存（计数在2^24以内精确）
+            x[nan] = 0
+            self.x_ = x
+            self.x2_ = x**2
+            self.m_ = (~nan).astype(np.float32)
+        else:
+            #无空值时标准化一次，相关系数即为内积
+            std = x.std(axis = 0)
+            x -= x.mean(axis = 0)
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                x /= std*np.sqrt(len(x))
+            self.x_ = x
+        del nan
+        self.cache_ = {}
+
+    def _calc(self, pos):
+        if not self.ifnan_:
+            return self.x_.T @ self.x_[:, pos]
+        x, m = self.x_, self.m_
+        xj, mj = x[:, pos], m[:, pos].astype(float)
+        #成对删除：只使用两个特征均非空的样本
+        sx = x.T @ mj; sxx = self.x2_.T @ mj; sxy = x.T @ xj
+        #涉及整个m的乘积按行分块转换为float64，避免整个m的float64拷贝
+        n = np.zeros_like(sxy); sy = np.zeros_like(sxy); syy = np.zeros_like(sxy)
+        step = max(1024, 2**20 // max(1, x.shape[1]))
+        for r in range(0, len(x), step):
+            mr, xr = m[r:r+step].astype(float).T, xj[r:r+step]
+            n += mr @ mj[r:r+step]; sy += mr @ xr; syy += mr @ (xr*xr)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            cov = sxy - sx*sy/n
+            vx, vy = sxx - sx**2/n, syy - sy**2/n
+            rlt = cov/np.sqrt(vx*vy)
+        #常数特征的方差只剩舍入误差，与DataFrame.corr一致返回空值
+        rlt[(n < 2) | (vx <= 1e-12*sxx) | (vy <= 1e-12*syy)] = np.nan
+        return rlt
+
+    def get(self, names):
+        """
+        返回(特征数, len(names))的数组，行与self.columns对应
+        """
+        todo = [i for i in dict.fromkeys(names) if i not in self.cache_]
+        for s in range(0, len(todo), self.block_size):
+            blk = todo[s:s+self.block_size]
+            rlt = self._calc(self.index.get_indexer(blk))
+            for j, i in enumerate(blk):
+                self.cache_[i] = np.clip(rlt[:, j], -1, 1)
+        if len(names) == 0:
+            return np.zeros((len(self.columns), 0))
+        return np.stack([self.cache_[i] for i in names], axis = 1)
+
+    def toFrame(self, names = None):
+        names = self.columns if names is None else list(names)
+        return pd.DataFrame(self.get(names), index = self.columns, columns = names)
+
 class ModelBasedMethods(object):
     """
     docstring for TreeBasedMethods:
@@ -31,12 +260,15 @@ class ModelBasedMethods(object):
     随机样本
     """
     def __init__(self, ftrs, label, features, corr, params, path, weights = None):
+        """
+        corr：特征的相关系数，可以是DataFrame（如data.corr()），或者corrCache只在需要时计算；为None时使用corrCache(ftrs)
+        """
         self.ftrs = ftrs
         self.label = label
         if ftrs is not None:
             if len(set(list(features))-set(list(self.ftrs.columns.values))) >= 1:
                 raise ValueError('feature N data not match!')
-        self.corr = corr
+        self.corr = corrCache(ftrs) if corr is None and ftrs is not None else corr
         self.params = params
         self.path = path
         self.weights = weights
@@ -72,39 +304,37 @@ class ModelBasedMethods(object):
             warnings.warn('not enough features for random feature selections')
         return tmp
     
+    def _corr_cols(self, names):
+        """
+        返回names与全部特征的相关系数数组及行对应的特征，self.corr可以是DataFrame或者corrCache
+        """
+        if isinstance(self.corr, corrCache):
+            return self.corr.get(list(names)), self.corr.index
+        return self.corr[list(names)].values, self.corr.index
+
     def _corr_filter(self, ftrs, musthave, corr_c = 0.75):
-        corr = self.corr.copy()
-        todrop = []
-        for i in musthave:
-            pc = corr[i][corr[i]>corr_c]
-            todrop += list(pc.index.values)
-            
-        todrop = list(set(todrop))
+        cols, index = self._corr_cols(musthave)
+        todrop = list(index[(cols > corr_c).any(axis = 1)])
         return list(set(ftrs)-set(todrop))
 
     def _random_select_cor(self, ftrs, nums, musthave = None, corr_c = 0.75, rnd_seed = None):
         #随机挑选特征，但要考虑相关性
-        corr = self.corr.copy()
         if rnd_seed is not None:
             random.seed(rnd_seed)
 
         if musthave is not None:
-            rlts = musthave
+            rlts = list(musthave)
         else:
             rlts = []
-        pcr = list(corr.index.values)
-        corr_tmp = corr.copy()
-
-        for i in rlts:
-            corr = corr_tmp.loc[pcr,:]
-            ops = corr_tmp.loc[pcr,i]
-            pcr = list(ops[ops<corr_c].index.values)
+        #alive标记仍可选择的特征，顺序与相关系数矩阵的index一致
+        cols, index = self._corr_cols(rlts)
+        alive = (cols < corr_c).all(axis = 1)
 
+        pcr = np.flatnonzero(alive)
         while  len(rlts)<nums and len(pcr)>0:
-            rlts += [random.sample(pcr, 1)[0]]
-            pc = corr.loc[pcr, rlts[-1]]
-            pc = pc[pc<corr_c]
-            pcr = list(pc.index.values)
+            rlts += [index[pcr[random.sample(range(len(pcr)), 1)[0]]]]
+            alive &= self._corr_cols(rlts[-1:])[0][:, 0] < corr_c
+            pcr = np.flatnonzero(alive)
 
         if len(rlts) < nums:
             warnings.warn('not enough features for random feature selections')
@@ -123,26 +353,30 @@ class ModelBasedMethods(object):
         根据特定指标及相关性进行特征选择
         tgt.shape = (n, 1)
         """
-        corr = self.corr.copy()
         score_name = list(tgt.columns.values)[0]
         tgt.sort_values(score_name, ascending = False, inplace = True)
         tgt = tgt[score_name]
         tgt = tgt[tgt>tgt_c]
         lstd_bs = list(tgt.index.values)
-        vld = []
         if size is None:
             real_size = len(tgt)
         else:
             real_size = size
-        while len(lstd_bs) >= 1 and len(vld) < real_size:
-            vld += [lstd_bs[0]]
-            lstd_bs = lstd_bs[1:]
-            corr_check = corr[vld[-1]].loc[lstd_bs]
-            corr_check = corr_check[corr_check>corr_c]
-            invld = list(corr_check.index.values)
-
-            for i in invld:
-                lstd_bs.remove(i)
+        #alive标记尚未入选且未被剔除的候选特征，按指标从大到小依次选择
+        alive = np.ones(len(lstd_bs), dtype = bool)
+        loc = self.corr.index.get_indexer(lstd_bs)
+        if (loc < 0).any():
+            raise KeyError('features not found in corr: %s'%str([a for a, l in zip(lstd_bs, loc) if l < 0]))
+        vld = []
+        for j in range(len(lstd_bs)):
+            if len(vld) >= real_size:
+                break
+            if not alive[j]:
+                continue
+            vld += [lstd_bs[j]]
+            alive[j] = False
+            corr_check = self._corr_cols(vld[-1:])[0][loc, 0]
+            alive &= ~(corr_check > corr_c)
 
         return vld
 
@@ -208,6 +442,53 @@ class ModelBasedMethods(object):
         self.model_ = model.fit(train, train_lb, test, test_lb, train_w, test_w)
         self.model_perform_ = self.model_.getMperfrm()
 
+    def setXgbStore(self, rnd_seed = None, test_size = 0.3, max_bin = None):
+        """
+        为反复在self.ftrs的特征子集上拟合xgboost准备数据：只做一次train_test_split，
+        并将全部特征转换为按列存储的float32数组，之后的特征子集只需按列切片
+        max_bin：不为None时按训练集分位数将各特征离散为不超过max_bin个分组的组号，
+        xgboost对每个子集的分位数草图只需处理少量不同取值；此时self.model_的输入为组号而不是原始取值
+        """
+        pos = np.arange(len(self.ftrs))
+        if self.weights is None:
+            train_pos, test_pos = train_test_split(pos, test_size = test_size, random_state = rnd_seed)
+            train_w = None; test_w = None
+        else:
+            train_pos, test_pos, train_w, test_w = train_test_split(pos, self.weights, test_size = test_size, random_state = rnd_seed)
+        x = self.ftrs.values.astype(np.float32)
+        x_train = np.asfortranarray(x[train_pos]); x_test = np.asfortranarray(x[test_pos])
+
+        cuts = None
+        if max_bin is not None:
+            cuts = {}
+            for j, i in enumerate(self.ftrs.columns):
+                col = x_train[:, j]
+                cuts[i] = np.unique(np.nanquantile(col, np.linspace(0, 1, max_bin+1))[1:-1]) if (~np.isnan(col)).any() else np.array([])
+                for arr in [x_train, x_test]:
+                    nan_loc = np.isnan(arr[:, j])
+                    arr[:, j] = np.searchsorted(cuts[i], arr[:, j], side = 'right')
+                    arr[nan_loc, j] = np.nan
+
+        self.xgb_store_ = {'columns':{i:j for j, i in enumerate(self.ftrs.columns)}, 'cuts':cuts,
+                           'train':x_train, 'test':x_test, 'train_lb':self.label.iloc[train_pos], 'test_lb':self.label.iloc[test_pos],
+                           'train_w':None if train_w is None else np.asarray(train_w), 'test_w':None if test_w is None else np.asarray(test_w)}
+
+    def featureStat_xgbStore(self, ftrs = None):
+        """
+        与featureStat_model(modeltype = 'xgb')一致，但使用setXgbStore准备好的切分及数组
+        """
+        if ftrs is None:
+            ftrs = self.features
+        ftrs = list(ftrs)
+        store = self.xgb_store_
+        idx = [store['columns'][i] for i in ftrs]
+
+        train_data = xgb.DMatrix(store['train'][:, idx], store['train_lb'].values, weight = store['train_w'], feature_names = ftrs)
+        test_data = xgb.DMatrix(store['test'][:, idx], store['test_lb'].values, weight = store['test_w'], feature_names = ftrs)
+        model = model_builder.xgbModel(params = self.params)
+        self.model_ = model.fit_dmatrix(train_data, store['train_lb'], test_data, store['test_lb'], ftrs)
+        self.model_perform_ = self.model_.getMperfrm()
+
     def getTvalues(self, mtrc, ifabs = False, name = None):
         feat_imp = pd.DataFrame(self.model_.getTvalues(mtrc), columns = ['fscore'])
         stat = feat_imp.to_dict()
@@ -231,44 +512,135 @@ class ModelBasedMethods(object):
 
         return rlt
 
-    def modelIprv_oneStep_plus(self, base_ftrs, tgts, modeltype = 'lr', rnd_seed = None, mtrc = 'auc', eval_s = 'train', test_size = 0):
+    def _oneStep_pool(self, n_jobs, start_method = None):
+        """
+        逐步回归候选特征并行计算的进程池
+        start_method：子进程启动方式，None时使用平台默认方式（macOS及Windows为spawn）；
+        'fork'可省去对象的序列化，但父进程已使用过xgboost/OpenMP或BLAS的线程时子进程可能卡死
+        """
+        if n_jobs < 0:
+            n_jobs = os.cpu_count()
+        ctx = multiprocessing.get_context(start_method)
+        return ProcessPoolExecutor(max_workers = n_jobs, mp_context = ctx, initializer = _oneStep_init, initargs = (self,))
+
+    def modelIprv_oneStep_plus(self, base_ftrs, tgts, modeltype = 'lr', rnd_seed = None, mtrc = 'auc', eval_s = 'train', test_size = 0, n_jobs = None, start_method = None):
         """
-        可以用多进程优化
+        在base_ftrs的基础上逐个加入tgts中的特征并拟合模型
+        n_jobs：多进程计算的进程数，None或1时逐个计算，-1时使用全部CPU
+        start_method：多进程的启动方式，见_oneStep_pool
+        多进程时各候选特征的结果按tgts的顺序收集，与逐个计算一致，但不会更新self.model_
         """
         all_rlts = {}
         all_tvls = {}
-        for i in tgts:
-            print(i)
-            try:
-                self.featureStat_model(base_ftrs+[i], modeltype, rnd_seed, test_size = test_size)
-                all_rlts[i] = self.model_perform_[eval_s][mtrc]
-                all_tvls[i] = self.model_.getTvalues()[i]
-            #except np.linalg.LinAlgError:
-            except:
-                all_rlts[i] = 0
-                all_tvls[i] = 0
+        if n_jobs is None or n_jobs == 1:
+            for i in tgts:
+                print(i)
+                try:
+                    self.featureStat_model(base_ftrs+[i], modeltype, rnd_seed, test_size = test_size)
+                    all_rlts[i] = self.model_perform_[eval_s][mtrc]
+                    all_tvls[i] = self.model_.getTvalues()[i]
+                #except np.linalg.LinAlgError:
+                except:
+                    all_rlts[i] = 0
+                    all_tvls[i] = 0
+        else:
+            with self._oneStep_pool(n_jobs, start_method) as executor:
+                tasks = [executor.submit(_oneStep_worker, base_ftrs+[i], modeltype, rnd_seed, test_size, eval_s, mtrc, i) for i in tgts]
+                for i, task in zip(tgts, tasks):
+                    try:
+                        all_rlts[i], all_tvls[i] = task.result()
+                    except:
+                        all_rlts[i] = 0
+                        all_tvls[i] = 0
 
         return all_rlts, all_tvls
 
-    def modelIprv_oneStep_minus(self, base_ftrs, modeltype = 'lr', rnd_seed = None, mtrc = 'auc', eval_s = 'train', test_size = 0):
+    def modelIprv_oneStep_minus(self, base_ftrs, modeltype = 'lr', rnd_seed = None, mtrc = 'auc', eval_s = 'train', test_size = 0, n_jobs = None, start_method = None):
         """
-        可以用多进程优化
+        逐个删除base_ftrs中的特征并拟合模型，返回删除后模型表现最好的特征
+        n_jobs、start_method同modelIprv_oneStep_plus
         """
         all_rlts = []
+        cands = []
         for i in base_ftrs:
             ops = base_ftrs[:]
             ops.remove(i)
-            try:
-                self.featureStat_model(ops, modeltype, rnd_seed, test_size = test_size)
-                all_rlts += [self.model_perform_[eval_s][mtrc]]
-            except np.linalg.LinAlgError:
-                all_rlts += [0]
+            cands += [ops]
+
+        if n_jobs is None or n_jobs == 1:
+            for ops in cands:
+                try:
+                    self.featureStat_model(ops, modeltype, rnd_seed, test_size = test_size)
+                    all_rlts += [self.model_perform_[eval_s][mtrc]]
+                except np.linalg.LinAlgError:
+                    all_rlts += [0]
+        else:
+            with self._oneStep_pool(n_jobs, start_method) as executor:
+                tasks = [executor.submit(_oneStep_worker, ops, modeltype, rnd_seed, test_size, eval_s, mtrc, None) for ops in cands]
+                for task in tasks:
+                    try:
+                        all_rlts += [task.result()[0]]
+                    except np.linalg.LinAlgError:
+                        all_rlts += [0]
 
         return {base_ftrs[all_rlts.index(max(all_rlts))]:max(all_rlts)}
     
+    def _stepwise_engine(self, base_ftrs, tgts, rnd_seed, test_size):
+        ftrs = list(base_ftrs) + list(tgts)
+        if self.ftrs[ftrs].isnull().max().max() == 1:
+            raise ValueError('unprocessed features with None values, pls check')
+        #同一(rnd_seed, test_size)下复用样本切分及上一步的拟合结果，fit以上一步的系数作为初始值
+        ifconst = self.params['ifconst'] if isinstance(self.params, dict) and 'ifconst' in self.params else True
+        if not hasattr(self, 'stepwise_'):
+            self.stepwise_ = {}
+        key = (rnd_seed, test_size)
+        engine = self.stepwise_.get(key)
+        if engine is None or engine.ifconst != ifconst:
+            if test_size == 0:
+                train, test, train_lb, test_lb = self.ftrs, None, self.label, None
+            else:
+                train, test, train_lb, test_lb = train_test_split(self.ftrs, self.label, test_size = test_size, random_state = rnd_seed)
+            engine = logitStepwise(train, train_lb, test, test_lb, ifconst = ifconst)
+            self.stepwise_[key] = engine
+        elif hasattr(engine, 'p_') and engine.base_ftrs == list(base_ftrs):
+            return engine
+        return engine.fit(base_ftrs)
+
+    def modelIprv_scoreStep_plus(self, base_ftrs, tgts, rnd_seed = None, mtrc = 'auc', eval_s = 'train', test_size = 0):
+        """
+        modelIprv_oneStep_plus的逻辑回归近似版本：基础模型只拟合一次，
+        候选特征用score检验及一步Newton更新评估，返回格式与modelIprv_oneStep_plus一致
+        mtrc：'auc'为一步更新后的近似AUC，'score'为score检验统计量
+        t值为score检验的近似t值
+        """
+        engine = self._stepwise_engine(base_ftrs, tgts, rnd_seed, test_size)
+        scores, tvls, aucs = engine.score_plus(tgts, eval_s, ifauc = mtrc == 'auc')
+        if mtrc == 'auc':
+            return aucs, tvls
+        elif mtrc == 'score':
+            return scores, tvls
+        else:
+            raise ValueError('other metrics not provided')
+
+    def modelIprv_scoreStep_minus(self, base_ftrs, rnd_seed = None, mtrc = 'auc', eval_s = 'train', test_size = 0):
+        """
+        modelIprv_oneStep_minus的逻辑回归近似版本，返回格式一致
+        mtrc：'auc'为删除后近似AUC最大的特征，'wald'为Wald统计量最小的特征
+        """
+        engine = self._stepwise_engine(base_ftrs, [], rnd_seed, test_size)
+        walds, aucs = engine.score_minus(eval_s, ifauc = mtrc == 'auc')
+        if mtrc == 'auc':
+            tgt = max(aucs, key = aucs.get)
+            return {tgt:aucs[tgt]}
+        elif mtrc == 'wald':
+            tgt = min(walds, key = walds.get)
+            return {tgt:walds[tgt]}
+        else:
+            raise ValueError('other metrics not provided')
+
     def featureSelection_randomSelect(self, ftr_names = None, modeltype = 'xgb', importance_type='gain',\
             threshold1 = 0.02,threshold2=0.01, threshold3=5, keep_rate=0.5, \
-            max_iter=100, min_num = 20, test_size = 0.3):
+            max_iter=100, min_num = 20, test_size = 0.3, ifcache = False, rnd_seed = None, max_bin = None):
         """
         one wx methods
         名义变量需提前处理
@@ -278,6 +650,7 @@ class ModelBasedMethods(object):
         threshold3:必定淘汰的变量gain排名的倒数百分占比
         keep_rate不确定保留变量下次进入训练的概率
         threshold1 >= threshold2 >= threshold3
+        ifcache：为True且modeltype为'xgb'时，只切分一次样本（rnd_seed）并复用setXgbStore的数组，参见setXgbStore
         """        
         #col保存每次剔除后剩余的所有变量
         if ftr_names is None:
@@ -287,9 +660,15 @@ class ModelBasedMethods(object):
         #subcol保存每次进入循环的变量
         subcol = col
         iter_num = 0
+        ifcache = ifcache and modeltype == 'xgb'
+        if ifcache:
+            self.setXgbStore(rnd_seed, test_size, max_bin)
         while True:
             iter_num += 1
-            self.featureStat_model(ftrs = subcol, modeltype = modeltype, rnd_seed = None, test_size = test_size)
+            if ifcache:
+                self.featureStat_xgbStore(ftrs = subcol)
+            else:
+                self.featureStat_model(ftrs = subcol, modeltype = modeltype, rnd_seed = rnd_seed, test_size = test_size)
             gain = pd.Series(data=np.zeros(len(subcol)),index=subcol)
             gain.loc[subcol] = gain.loc[subcol]+pd.Series(self.getTvalues(mtrc = importance_type)['fscore'])
             gain /= gain.sum()#计算带入列gain百分比
@@ -316,13 +695,15 @@ class ModelBasedMethods(object):
         return subcol.tolist()
     
     def featureSelection_roundSelect(self, ftr_names = None, cycles = 12, modeltype = 'xgb', \
-                                     step=4, importance_type=['gain','cover'], min_n=40, test_size = 0.3):
+                                     step=4, importance_type=['gain','cover'], min_n=40, test_size = 0.3, \
+                                     ifcache = False, rnd_seed = None, max_bin = None):
         """
         two wx methods
         X必须DataFrame
         名义变量需预处理
         step:每次剔除变量重要性后step%的变量
         输出保留变量(重要性从小到大排序)
+        ifcache：同featureSelection_randomSelect
         """
     
         def cal(list_=[]): 
@@ -338,10 +719,16 @@ class ModelBasedMethods(object):
             columns = self.ftrs[ftr_names].columns
 
         gain=pd.Series(data=np.zeros(len(columns)),index=columns)
+        ifcache = ifcache and modeltype == 'xgb'
+        if ifcache:
+            self.setXgbStore(rnd_seed, test_size, max_bin)
         try:
             with tqdm(range(cycles)) as t:
                 for i in t:
-                    self.featureStat_model(ftrs = columns, modeltype = modeltype, rnd_seed = None, test_size = test_size)
+                    if ifcache:
+                        self.featureStat_xgbStore(ftrs = columns)
+                    else:
+                        self.featureStat_model(ftrs = columns, modeltype = modeltype, rnd_seed = rnd_seed, test_size = test_size)
                     imp = eval(cal(list_ = importance_type))
                     gain.loc[imp.index] += imp
                     columns=imp[imp>np.percentile(imp,step)].index; gain =gain.loc[columns]
@@ -354,10 +741,115 @@ class ModelBasedMethods(object):
         t.close()
         return columns[gain.argsort()[::-1]].tolist()
 
-    def featureSelection_AvgScore(self, top = None, ftr_c = 0.65):
+    def _worker_params(self, n_jobs):
+        """
+        多进程建模时各子进程使用的模型参数：xgboost的nthread（包括cvModel内部xgboost的参数）按进程数平均分配CPU，
+        cvModel内部的各折不再并行，避免进程数*线程数超过CPU数
+        """
+        params = deepcopy(self.params)
+        budget = max(1, os.cpu_count() // n_jobs)
+        inner = params.get('params')
+        for p in [params, inner, inner.get('params') if isinstance(inner, dict) else None]:
+            if isinstance(p, dict) and 'nthread' in p.keys():
+                p['nthread'] = budget if p['nthread'] is None or p['nthread'] <= 0 else min(p['nthread'], budget)
+        if 'n_jobs' in params.keys():
+            params['n_jobs'] = None
+        return params
+
+    def _saveExperiment(self, checkpoint, name, rlt):
+        """
+        将一次实验的结果追加写入checkpoint文件，每个特征一行：实验名称、模型表现、特征及重要性
+        """
+        file = self.path + '/feat_imps/' + checkpoint
+        rcd = pd.DataFrame({'grp':name, 'train_auc':rlt[0], 'test_auc':rlt[1], 'ftr':rlt[2].index, 'imp':rlt[2].values})
+        rcd.to_csv(file, mode = 'a', header = not os.path.exists(file), index = False)
+
+    def featureSelection_randomExperiment(self, runs = 10, nums = 50, modeltype = 'xgb', importance_type = 'gain', \
+                                          rnd_seed = None, select_seed = None, corr_c = 0.75, n_jobs = None, checkpoint = None, \
+                                          start_method = None):
+        """
+        随机抽取特征组合并建模的重复实验，代替逐个运行featureStat_model + getTvalues(name = ...)写JSON的方式
+        runs：实验次数，nums：每次抽取的特征数，rnd_seed：建模时样本切分的随机数
+        select_seed：不为None时第i次实验使用select_seed+i抽取特征，结果可复现
+        n_jobs：多进程计算的进程数，None或1时逐个计算，-1时使用全部CPU；xgboost的线程数按进程数分配
+        start_method：多进程的启动方式，见_oneStep_pool
+        checkpoint：不为None时每完成一次实验即追加写入self.path+'/feat_imps/'下的csv文件；
+        文件已存在时跳过其中已完成的实验（按实验名称grp_i），中断后可继续运行，需配合select_seed使用以保证特征组合一致
+        结果保存在self.experiment_imps_（特征*实验）及self.experiment_perf_（实验*[train_auc, test_auc]）
+        """
+        names = ['grp_'+str(i) for i in range(runs)]
+        subsets = [self._random_select_cor(list(self.features), nums, musthave = None, corr_c = corr_c, \
+                                           rnd_seed = None if select_seed is None else select_seed+i) for i in range(runs)]
+
+        done = {}
+        if checkpoint is not None:
+            tools.mkdir(self.path + '/feat_imps')
+            if os.path.exists(self.path + '/feat_imps/' + checkpoint):
+                perf, imps = self._loadExperiment(checkpoint)
+                done = {n:(perf.loc[n, 'train_auc'], perf.loc[n, 'test_auc'], imps[n].dropna()) for n in perf.index if n in names}
+        todo = [(n, ftrs) for n, ftrs in zip(names, subsets) if n not in done.keys()]
+
+        def _finish(n, rlt):
+            done[n] = rlt
+            if checkpoint is not None:
+                self._saveExperiment(checkpoint, n, rlt)
+
+        if n_jobs is None or n_jobs == 1:
+            for n, ftrs in tqdm(todo):
+                self.featureStat_model(ftrs, modeltype = modeltype, rnd_seed = rnd_seed)
+                imp = self.getTvalues(importance_type, ifabs = True)['fscore']
+                _finish(n, (self.model_perform_['train']['auc'], self.model_perform_['test']['auc'], imp))
+        elif len(todo) > 0:
+            n_jobs = os.cpu_count() if n_jobs < 0 else n_jobs
+            params = self._worker_params(n_jobs)
+            with self._oneStep_pool(n_jobs, start_method) as executor:
+                tasks = {executor.submit(_experiment_worker, ftrs, modeltype, rnd_seed, importance_type, params):n for n, ftrs in todo}
+                for task in tqdm(as_completed(tasks), total = len(tasks)):
+                    _finish(tasks[task], task.result())
+
+        rlts = [done[n] for n in names]
+        self.experiment_perf_ = pd.DataFrame([a[:2] for a in rlts], index = names, columns = ['train_auc', 'test_auc'])
+        self.experiment_imps_ = pd.concat([a[2].rename(n) for n, a in zip(names, rlts)], axis = 1, sort = True)
+
+        return self.experiment_perf_, self.experiment_imps_
+
+    def _loadExperiment(self, checkpoint):
+        rcd = pd.read_csv(self.path + '/feat_imps/' + checkpoint)
+        perf = rcd.drop_duplicates('grp').set_index('grp')[['train_auc', 'test_auc']]
+        imps = rcd.pivot(index = 'ftr', columns = 'grp', values = 'imp')[list(perf.index)]
+        perf.index.name = None; imps.index.name = None; imps.columns.name = None
+        return perf, imps
+
+    def featureSelection_AvgScore(self, top = None, ftr_c = 0.65, source = 'json'):
         """
         根据不断随机的抽取特征后的各模型表现进行特征评估
+        source：'json'读取feat_imps下逐次保存的JSON文件；'memory'使用featureSelection_randomExperiment的结果；
+        其他字符串为featureSelection_randomExperiment保存的checkpoint文件名
         """
+        if source == 'json':
+            return self._avgScore_json(top, ftr_c)
+
+        if source == 'memory':
+            perf, imps = self.experiment_perf_, self.experiment_imps_
+        else:
+            perf, imps = self._loadExperiment(source)
+
+        vald_records = list(perf.index[perf['train_auc']>=ftr_c])
+        if len(vald_records) == 0:
+            raise ValueError('Not Enough Model')
+        rlt = imps[vald_records]
+        if top is not None:
+            #每次实验只保留重要性排名前top的特征
+            rlt = rlt.where(rlt.rank(ascending = False, method = 'first') <= top)
+        rlt = rlt.dropna(how = 'all')
+
+        fnl = pd.DataFrame(rlt.mean(axis = 1, skipna = True), columns = ['avg'])
+        fnl['cnt'] = rlt.count(axis = 1, numeric_only = True)
+        fnl['score'] = fnl['avg'] * fnl['cnt'].apply(lambda x: np.log(2+x))
+
+        return fnl
+
+    def _avgScore_json(self, top = None, ftr_c = 0.65):
         model_p = pd.read_table(self.path+'/feat_imps/all_auc.json', sep = ' ', names = ['files', 'train_auc', 'test_auc'])
         model_p = model_p[model_p['train_auc']>=ftr_c]
         vald_records = list(model_p['files'])
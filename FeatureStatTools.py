@@ -195,6 +195,188 @@ def ft_mis_check2(df, tp, grps = 10):
 
     return vl_check   
 
+def _chi2_2x2_pvalue(tables):
+    """
+    批量计算2x2列联表的卡方检验p值，结果与chi2_contingency（含Yates修正）一致
+    tables：(m, 2, 2)的数组
+    """
+    tables = np.asarray(tables, dtype = float)
+    n = tables.sum(axis = (1, 2))
+    expected = tables.sum(axis = 2)[:, :, None] * tables.sum(axis = 1)[:, None, :] / n[:, None, None]
+    diff = expected - tables
+    observed = tables + np.minimum(0.5, np.abs(diff)) * np.sign(diff)
+    terms = ((observed - expected)**2/expected).reshape(len(tables), 4)
+    chi2 = terms[:, 0] + terms[:, 1] + terms[:, 2] + terms[:, 3]
+    return stats.chi2.sf(chi2, 1)
+
+def _top2_bins(sorted_x, cnt, min_v, max_v, grps, total):
+    """
+    ft_mis_check2中float类型的等宽分组，返回样本最多的两个分组及占比
+    """
+    bins = [min_v + i * np.float((max_v-min_v))/grps for i in range(grps)] + [max_v+1]
+    bins = sorted(set(bins))
+    labels = [str(a) for a in pd.cut(pd.Series([], dtype = float), bins = bins, right = False).cat.categories]
+    counts = np.diff(np.searchsorted(sorted_x[:cnt], bins, side = 'left'))
+    order = np.argsort(-counts, kind = 'stable')
+    rlt = []
+    for j in range(2):
+        if j < len(order):
+            rlt += [labels[order[j]], counts[order[j]]/total]
+        else:
+            rlt += [None, None]
+    return rlt
+
+def _ks_table_sorted(x, cum_bad, grps = 10, ascd = False, duplicates = 'drop'):
+    """
+    基于升序排列的非空特征x及累计bad数cum_bad（长度为len(x)+1，首位为0）计算KS分组表
+    分组方式与pd.qcut一致：等频分割点，左开右闭区间且包含最小值
+    ascd为False时按特征降序排列并累加，返回各列为数组的字典
+    """
+    n = len(x)
+    if n == 0:
+        raise ValueError('empty input for ks calculation')
+    edges = np.quantile(x, np.linspace(0, 1, grps+1))
+    if len(np.unique(edges)) < len(edges) and duplicates == 'raise':
+        raise ValueError('Bin edges must be unique: %s'%repr(edges))
+    edges = np.unique(edges)
+    if len(edges) < 2:
+        edges = edges[:0]
+
+    ends = np.searchsorted(x, edges[1:], side = 'right')
+    starts = np.concatenate([[0], ends[:-1]]).astype(ends.dtype)
+    size = ends - starts
+    bad_cnt = cum_bad[ends] - cum_bad[starts]
+    with np.errstate(invalid = 'ignore'):
+        min_ft = np.where(size > 0, x[np.minimum(starts, n-1)], np.nan)
+        max_ft = np.where(size > 0, x[np.maximum(ends-1, 0)], np.nan)
+    rlt = {'lower':edges[:-1], 'upper':edges[1:], 'min_ft':min_ft, 'max_ft':max_ft, 'size':size, 'bad_cnt':bad_cnt}
+    if not ascd:
+        rlt = {k:v[::-1] for k, v in rlt.items()}
+
+    bad_all = cum_bad[n]; good_all = n - bad_all
+    rlt['good_cnt'] = rlt['size'] - rlt['bad_cnt']
+    rlt['good_cumsum'] = np.cumsum(rlt['good_cnt'])
+    rlt['bad_cumsum'] = np.cumsum(rlt['bad_cnt'])
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        rlt['bad_pct'] = rlt['bad_cnt']/rlt['size']
+        rlt['bad_cumsum_pct'] = rlt['bad_cumsum']/bad_all
+        rlt['good_cumsum_pct'] = rlt['good_cumsum']/good_all
+    rlt['ks'] = rlt['bad_cumsum_pct'] - rlt['good_cumsum_pct']
+    return rlt
+
+def _ks_sorted(sorted_x, cum_bad, cnt, grps):
+    """
+    基于排序后的特征及累计bad数计算KS，分组方式与ks_cal_func一致（qcut，重复分割点删除）
+    """
+    if cnt == 0:
+        return None
+    ks = np.abs(_ks_table_sorted(sorted_x[:cnt], cum_bad[:cnt+1], grps)['ks'])
+    if len(ks) == 0 or np.isnan(ks).all():
+        return np.nan
+    return np.nanmax(ks)
+
+def _psi_sorted(sorted_bf, cnt_bf, n_bf, sorted_af, cnt_af, n_af, grps):
+    """
+    基于排序后的特征计算PSI，分组方式与psi_cal_func一致
+    """
+    #与psi_cal_func一致，bf全部为空时无法计算
+    if cnt_bf == 0:
+        return None
+    mins = [a[0] for a, c in [(sorted_bf, cnt_bf), (sorted_af, cnt_af)] if c > 0]
+    maxs = [a[c-1] for a, c in [(sorted_bf, cnt_bf), (sorted_af, cnt_af)] if c > 0]
+    min_v = min(mins); max_v = max(maxs)
+    step = (max_v - min_v)/grps
+    cuts = [min_v + step * a for a in range(grps)]+[max_v+1]
+    cuts = sorted(set(cuts))
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        b_stat = np.diff(np.searchsorted(sorted_bf[:cnt_bf], cuts, side = 'left'))/np.float(n_bf)
+        a_stat = np.diff(np.searchsorted(sorted_af[:cnt_af], cuts, side = 'left'))/np.float(n_af)
+        b_stat[b_stat == 0] = np.nan; a_stat[a_stat == 0] = np.nan
+        return np.nansum((b_stat - a_stat)*np.log(b_stat/a_stat))
+
+def ft_stat_batch(X, y, bf_mask = None, ftrs = None, types = None, grps = 10, output = None, block_size = 500):
+    """
+    批量计算数值型特征的缺失及分布情况、KS及PSI，结果与ft_mis_check2，ks_cal_func，psi_cal_func逐个特征计算一致
+    1.X：特征矩阵（DataFrame或者数组），ftrs为数组时对应的特征名称；y：label；
+    2.bf_mask：布尔数组，True为前一时间段样本（bf），False为后一时间段样本（af），为None时不计算KS及PSI；
+    3.types：特征类型{特征:'int'/'float'}，决定分布统计方式，默认为float；
+    4.output：不为空时输出misStat.json，ksStat.json，psiStat.json；
+    5.block_size：每次处理的特征数，类型转换、缺失统计及排序均逐块进行，控制峰值内存
+    只适用于数值型特征，字符型特征仍需使用ft_mis_check2
+    """
+    if isinstance(X, pd.DataFrame):
+        ftrs = list(X.columns.values)
+    else:
+        X = np.asarray(X)
+    y = np.asarray(y)
+    if types is None:
+        types = {}
+    total = len(y)
+    is_bad, is_good = y == 1, y == 0
+
+    if bf_mask is not None:
+        bf_mask = np.asarray(bf_mask, dtype = bool)
+        periods = {'bf':bf_mask, 'af':~bf_mask}
+
+    mis = {}; kses = {}; psis = {}
+    for s in range(0, len(ftrs), block_size):
+        blk = slice(s, min(s + block_size, len(ftrs)))
+        #逐块转换为浮点数组，峰值内存只与block_size有关
+        Xb = np.asarray(X.iloc[:, blk].values if isinstance(X, pd.DataFrame) else X[:, blk], dtype = float)
+
+        #缺失与label的卡方检验
+        isna = np.isnan(Xb)
+        na_bad = isna[is_bad].sum(axis = 0)
+        na_good = isna[is_good].sum(axis = 0)
+        notna_bad = is_bad.sum() - na_bad
+        notna_good = is_good.sum() - na_good
+        tables = np.stack([np.stack([notna_bad, notna_good], axis = 1), np.stack([na_bad, na_good], axis = 1)], axis = 1)
+        kf_valid = tables.reshape(Xb.shape[1], 4).min(axis = 1) > 5
+        kf = np.full(Xb.shape[1], np.nan)
+        if kf_valid.any():
+            kf[kf_valid] = _chi2_2x2_pvalue(tables[kf_valid])
+        cvr = 1 - isna.mean(axis = 0)
+        del isna
+
+        #空值排在最后，cnt为非空数量
+        sorted_all = np.sort(Xb, axis = 0)
+        cnt_all = (~np.isnan(sorted_all)).sum(axis = 0)
+        sorted_prd = {}
+        if bf_mask is not None:
+            for k, m in periods.items():
+                order = np.argsort(Xb[m], axis = 0, kind = 'stable')
+                x = np.take_along_axis(Xb[m], order, axis = 0)
+                cum_bad = np.vstack([np.zeros((1, x.shape[1]), dtype = np.int64), np.cumsum(y[m][order] == 1, axis = 0)])
+                sorted_prd[k] = (x, cum_bad, (~np.isnan(x)).sum(axis = 0), m.sum())
+
+        for j, i in enumerate(ftrs[blk]):
+            tp = types.get(i, 'float')
+            if tp == 'int':
+                col = Xb[:, j]
+                mis[i] = {'type': 'int', 'cvr_rate':cvr[j], 'kf_p':kf[j], 'value_0':0, 'value_0_pct':(col == 0).mean(), 'value_1':1, 'value_1_pct':(col == 1).mean()}
+            else:
+                if cnt_all[j] > 0:
+                    top2 = _top2_bins(sorted_all[:, j], cnt_all[j], sorted_all[0, j], sorted_all[cnt_all[j]-1, j], grps, total)
+                else:
+                    top2 = [None]*4
+                mis[i] = {'type': 'float', 'cvr_rate':cvr[j], 'kf_p':kf[j], 'value_0':top2[0], 'value_0_pct':top2[1], 'value_1':top2[2], 'value_1_pct':top2[3]}
+
+            if bf_mask is not None:
+                ks = {k:_ks_sorted(v[0][:, j], v[1][:, j], v[2][j], grps) for k, v in sorted_prd.items()}
+                #与逐个特征计算时一致，任一时间段无法计算时均记为None
+                kses[i] = ks if None not in ks.values() else {'bf':None, 'af':None}
+                bf, af = sorted_prd['bf'], sorted_prd['af']
+                psis[i] = _psi_sorted(bf[0][:, j], bf[2][j], bf[3], af[0][:, j], af[2][j], af[3], grps)
+
+    if output is not None:
+        tools.putFile(output, 'misStat.json', mis)
+        if bf_mask is not None:
+            tools.putFile(output, 'ksStat.json', kses)
+            tools.putFile(output, 'psiStat.json', psis)
+
+    return mis, kses, psis
+
 def ft_corr(df):
     """
     计算相关性
@@ -248,29 +430,115 @@ def tvalue_cal_func(df, ifconst = True):
     model = sm.Logit(y, x).fit()
     return model.tvalues[ft_name]
 
+def tvalue_cal_batch(X, y, ftrs = None, ifconst = True, max_iter = 35, tol = 1e-8, block_size = 50):
+    """
+    批量计算单因子逻辑回归（单个特征+常数项），结果与逐个特征调用tvalue_cal_func一致
+    1.X：特征矩阵（DataFrame或者数组），ftrs为数组时对应的特征名称；y：label；
+    2.各特征只使用自身非空的样本，所有特征同时进行向量化的Newton迭代，已收敛的特征不再参与迭代；
+    3.block_size：每次处理的特征数，控制(样本数, block_size)中间数组的内存占用
+    返回以特征为index的DataFrame：coef，const（没有常数项时为空），tvalue，converged，size
+    无法拟合（如全部为空、完全分离）的特征converged为False，tvalue为空
+    """
+    if isinstance(X, pd.DataFrame):
+        ftrs = list(X.columns.values)
+        X = X.values
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+
+    coef = np.zeros(len(ftrs)); const = np.zeros(len(ftrs)); tvalue = np.full(len(ftrs), np.nan)
+    converged = np.zeros(len(ftrs), dtype = bool)
+    size = (~np.isnan(X)).sum(axis = 0)
+    use_const = np.zeros(len(ftrs), dtype = bool)
+    for s in range(0, len(ftrs), block_size):
+        idx = np.arange(s, min(s + block_size, len(ftrs)))
+        mask = ~np.isnan(X[:, idx])
+        x = np.where(mask, X[:, idx], 0)
+        if ifconst and len(x) > 0:
+            #与sm.add_constant一致，取值唯一的特征不再添加常数项
+            use_const[idx] = np.where(mask, x, -np.inf).max(axis = 0) > np.where(mask, x, np.inf).min(axis = 0)
+        a = np.zeros(len(idx)); b = np.zeros(len(idx))
+        active = np.arange(len(idx))
+        for _ in range(max_iter + 1):
+            xa, ma = x[:, active], mask[:, active]
+            p = 1.0/(1.0 + np.exp(-(a[active] + b[active]*xa)))
+            w = p*(1-p)*ma
+            r = (y[:, None] - p)*ma
+            #没有常数项的特征取g_a = h_ab = 0，h_aa = 1，常数项保持为0
+            c = use_const[idx[active]]
+            g_b = (r*xa).sum(axis = 0); h_bb = (w*xa*xa).sum(axis = 0)
+            g_a = np.where(c, r.sum(axis = 0), 0); h_aa = np.where(c, w.sum(axis = 0), 1); h_ab = np.where(c, (w*xa).sum(axis = 0), 0)
+            det = h_aa*h_bb - h_ab**2
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                #t值使用迭代前参数处的信息矩阵，收敛时与最终参数处一致
+                var_b = h_aa/det
+                step_b = (h_aa*g_b - h_ab*g_a)/det
+                step_a = (h_bb*g_a - h_ab*g_b)/det
+            done = np.abs(step_a) + np.abs(step_b) < tol
+            tvalue[idx[active[done]]] = b[active[done]]/np.sqrt(var_b[done])
+            converged[idx[active[done]]] = True
+
+            #不可逆或发散的特征停止迭代
+            keep = ~done & np.isfinite(step_a) & np.isfinite(step_b) & (det > 0)
+            a[active[keep]] += step_a[keep]; b[active[keep]] += step_b[keep]
+            active = active[keep]
+            if len(active) == 0:
+                break
+        coef[idx] = b; const[idx] = a
+
+    converged &= np.isfinite(tvalue)
+    tvalue[~converged] = np.nan
+    return pd.DataFrame({'coef':coef, 'const':np.where(use_const, const, np.nan), 'tvalue':tvalue, 'converged':converged, 'size':size}, index = ftrs)
+
+def ks_cal_array(score, label, grps = 10, ascd = False, duplicates = 'drop'):
+    """
+    只使用numpy计算KS，一次排序同时得到：
+    1.所有取值作为分割点时的最大KS（精确值）；
+    2.与ks_cal_func一致的等频分组表，各列为数组的字典，lower/upper为分组的分割点
+    score, label：一维数组，score为空的样本不参与计算
+    """
+    score = np.asarray(score, dtype = float)
+    label = np.asarray(label)
+    valid = ~np.isnan(score)
+    if not valid.all():
+        score = score[valid]; label = label[valid]
+
+    #取值相同的样本在分组及累计时不会被分开，不需要稳定排序
+    order = np.argsort(score)
+    x = score[order]
+    cum_bad = np.concatenate([[0], np.cumsum(label[order])])
+    table = _ks_table_sorted(x, cum_bad, grps, ascd, duplicates)
+
+    #取值相同的样本不能分开，只在取值变化处计算累计占比
+    ends = np.append(np.flatnonzero(x[1:] != x[:-1]) + 1, len(x))
+    bad_all = cum_bad[-1]; good_all = len(x) - bad_all
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ks = np.abs(cum_bad[ends]/bad_all - (ends - cum_bad[ends])/good_all)
+    ks_max = np.nanmax(ks) if not np.isnan(ks).all() else np.nan
+
+    return ks_max, table
+
 def ks_cal_func(df, grps=10, ascd = False, duplicates = 'drop'):
     """
     计算KS值
     duplicates用于处理非俊宇
+    分组统计由ks_cal_array完成，返回的DataFrame与原有的qcut+groupby方式一致
     """
     ft_name, _ = df.columns.values
     #单因子统计的时候不需要考虑缺失情况
     df = df.dropna()
 
-    df.sort_values(by = ft_name, ascending = ascd, inplace = True)
-    df['grps'] = pd.qcut(df[ft_name], q = grps, duplicates = duplicates)
-
-    stat = df.groupby('grps', as_index = False).agg({ft_name:['min', 'max'], 'label':['count', 'sum']})
-    stat.columns = ['grps', 'min_ft', 'max_ft', 'size', 'bad_cnt']
-    stat.sort_values('grps', ascending = ascd, inplace = True)
-
-    stat['good_cnt'] = stat['size'] - stat['bad_cnt']
-    stat['good_cumsum'] = stat['good_cnt'].cumsum()
-    stat['bad_cumsum'] = stat['bad_cnt'].cumsum()
-
-    stat['bad_pct'] = stat['bad_cnt']/stat['size']
-    stat['bad_cumsum_pct'] = stat['bad_cumsum']/df['label'].sum()
-    stat['good_cumsum_pct'] = stat['good_cumsum']/(len(df)-df['label'].sum())
+    _, table = ks_cal_array(df[ft_name].values, df['label'].values, grps, ascd, duplicates)
+    k = len(table['size'])
+    #分组标签与qcut一致：由分割点经pd.cut生成区间（包含最小值）
+    order = range(k-1, -1, -1) if not ascd else range(k)
+    if k > 0:
+        edges = np.append(np.sort(table['lower']), table['upper'].max())
+        cats = pd.cut(pd.Series(edges[1:]), bins = edges, include_lowest = True).cat.categories
+        grp = pd.Categorical.from_codes(list(order), categories = cats, ordered = True)
+    else:
+        grp = pd.Categorical([], categories = pd.IntervalIndex.from_breaks(np.array([], dtype = float)), ordered = True)
 
-    stat['ks'] = (stat['bad_cumsum_pct'] - stat['good_cumsum_pct'])
+    stat = pd.DataFrame({'grps':grp}, index = order)
+    for i in ['min_ft', 'max_ft', 'size', 'bad_cnt', 'good_cnt', 'good_cumsum', 'bad_cumsum', 'bad_pct', 'bad_cumsum_pct', 'good_cumsum_pct', 'ks']:
+        stat[i] = table[i]
     return stat
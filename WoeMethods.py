@@ -1,13 +1,14 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import os
 import re
 import json
 from scipy import stats
 import warnings
 
 from tqdm import tqdm
-from sklearn.tree import DecisionTreeClassifier
+from concurrent.futures import ProcessPoolExecutor
 
 
 import tools
@@ -35,6 +36,7 @@ class bins_method_funcs(object):
         """
         self.raw = df
         self.ft_name = list(self.raw.columns.values)[0]
+        self.prep = None
 
     def setParams(self, params):
         """
@@ -45,6 +47,66 @@ class bins_method_funcs(object):
                 warnings.warn('Invalid Parameters, Please Check')
             self.argms[i] = params[i]
 
+    def _getPrep(self):
+        """
+        特征的预处理表示，setTgt后首次调用时构建，之后各分箱方法共用：
+        vals：剔除空值并排序后的特征取值数组，保留原有数据类型
+        cum_bad：按vals顺序累计的bad样本数，首位为0，长度为len(vals)+1
+        cum_n：按vals顺序累计的样本数，None表示vals中每个取值对应一个样本
+        min, max：特征的最小及最大值
+        也可以通过setPrep直接设定分组计数形式的表示，此时vals为各分组的最小值
+        """
+        if self.prep is None:
+            tmp = self.raw.dropna()
+            vals = tmp[self.ft_name].values
+            order = np.argsort(vals, kind = 'mergesort')
+            vals = vals[order]
+            self.prep = {'vals':vals, 'cum_bad':np.concatenate([[0], np.cumsum(tmp['label'].values[order] == 1)]), \
+                         'cum_n':None, 'min':vals[0], 'max':vals[-1]}
+
+        return self.prep
+
+    def _prep_cum_n(self, locs):
+        """
+        vals中位置对应的累计样本数
+        """
+        cum_n = self._getPrep()['cum_n']
+        if cum_n is None:
+            return locs
+        return cum_n[locs]
+
+    def _prep_size(self):
+        return self._prep_cum_n(len(self._getPrep()['vals']))
+
+    def _prep_quantile(self, q):
+        """
+        在排序数组上直接取分位数，与Series.quantile(q, interpolation = 'lower')结果一致
+        分组计数形式的表示返回分位点所在分组的最小值
+        """
+        prep = self._getPrep()
+        #与numpy中lower插值的下标计算方式保持一致
+        loc = int(np.floor((self._prep_size()-1) * (q*100/100)))
+        if prep['cum_n'] is not None:
+            loc = np.searchsorted(prep['cum_n'], loc, side = 'right') - 1
+        return prep['vals'][loc]
+
+    def _prep_count_table(self, cuts, cap_info = None):
+        """
+        通过在排序数组上二分查找分割点，由累计bad样本数得到各分组的好坏样本数
+        cap_info：与_llt_cap_func一致，统计前先将取值截断至最小及最大值之间
+        返回形状与_bins_count_table一致
+        """
+        prep = self._getPrep()
+        vals = prep['vals']
+        if cap_info is not None:
+            vals = np.clip(vals, cap_info['min'], cap_info['max'])
+
+        locs = np.searchsorted(vals, np.asarray(cuts, dtype = float), side = 'left')
+        size = np.diff(self._prep_cum_n(locs))
+        bad = np.diff(prep['cum_bad'][locs])
+
+        return np.column_stack([size - bad, bad])
+
     def _chi_cal_func(self, data):
         """
         所有相邻分组直接的卡方计算
@@ -75,6 +137,57 @@ class bins_method_funcs(object):
         """
         return max(s, min(x, b))
 
+    def _bins_count_table(self, vals, label, cuts):
+        """
+        按分割点（左闭右开，与pd.cut一致）统计各分组的好坏样本数，超出分割点范围及空值的样本不计入
+        返回形状为(分组数, 2)的数组，第一列为good（label为0），第二列为bad（label为1）
+        """
+        cuts = np.asarray(cuts, dtype = float)
+        vals = np.asarray(vals, dtype = float)
+        label = np.asarray(label)
+
+        grp = np.searchsorted(cuts, vals, side = 'right') - 1
+        vld = (grp >= 0) & (grp < len(cuts)-1)
+        good = np.bincount(grp[vld & (label == 0)], minlength = len(cuts)-1)
+        bad = np.bincount(grp[vld & (label == 1)], minlength = len(cuts)-1)
+
+        return np.column_stack([good, bad])
+
+    def _merge_count_table(self, counts, loc):
+        """
+        合并计数表中第loc及loc+1个分组，对应从分割点中删除cuts[loc+1]
+        """
+        merged = np.delete(counts, loc+1, axis = 0)
+        merged[loc] += counts[loc+1]
+        return merged
+
+    def _chi_cal_counts(self, counts):
+        """
+        基于分组计数表计算所有相邻分组之间卡方检验的p值，与_chi_cal_func的pivot结果保持一致：
+        某一label在相邻两组中均为0时列联表退化为一行，p值为1；
+        某一label只在其中一组为0时pivot会产生缺失值，p值为nan；
+        其余按chi2_contingency对2x2列联表的计算方式（含Yates修正）一次性向量化计算
+        """
+        counts = np.asarray(counts, dtype = float)
+        if len(counts) < 2:
+            return []
+        obs = np.stack([counts[:-1, 0], counts[1:, 0], counts[:-1, 1], counts[1:, 1]], axis = 1).reshape(-1, 2, 2)
+        degen = (obs.sum(axis = 2) == 0).any(axis = 1)
+        miss = (obs == 0).reshape(-1, 4).any(axis = 1) & ~degen
+
+        chis = np.full(len(obs), np.nan)
+        chis[degen] = 1.0
+        ok = ~(degen | miss)
+        if ok.any():
+            obs = obs[ok]
+            expected = obs.sum(axis = 2)[:, :, None] * obs.sum(axis = 1)[:, None, :] / obs.sum(axis = (1, 2))[:, None, None]
+            diff = expected - obs
+            obs = obs + np.minimum(0.5, np.abs(diff)) * np.sign(diff)
+            terms = ((obs - expected)**2 / expected).reshape(-1, 4)
+            chi = terms[:, 0] + terms[:, 1] + terms[:, 2] + terms[:, 3]
+            chis[ok] = stats.chi2.sf(chi, 1)
+        return list(chis)
+
     def _bins_merge_chiq(self, tgt, cuts):
         """
         基于卡方的单调性保证：
@@ -84,19 +197,26 @@ class bins_method_funcs(object):
         参数含义：
         1.tgt，目标特征及label
         2.cuts，对应bins
+        分组计数只统计一次，之后的合并只在计数表上进行
         """
-        df = tgt.copy().dropna()
+        df = tgt.dropna()
         ft_name, _ = df.columns.values
 
-        df.loc[:, 'grp'] = pd.cut(df[ft_name], bins = cuts, labels = range(len(cuts)-1), right = False)
-        chis = self._chi_cal_func(df)
+        counts = self._bins_count_table(df[ft_name].values, df['label'].values, cuts)
+        return self._bins_merge_chiq_counts(counts, cuts)
+
+    def _bins_merge_chiq_counts(self, counts, cuts):
+        """
+        _bins_merge_chiq在分组计数表上的实现，counts与cuts对应
+        """
+        chis = self._chi_cal_counts(counts)
 
         #单调性检验，同时合并卡方最不显著的分组
         while len(set([chis[i] < chis[i+1] for i in range(len(chis)-2)]))>1:
             lct = chis.index(max(chis))
             cuts.remove(cuts[lct+1])
-            df = df.assign(grp = pd.cut(df[ft_name], bins = cuts, labels = range(len(cuts)-1), right = False))
-            chis = self._chi_cal_func(df)
+            counts = self._merge_count_table(counts, lct)
+            chis = self._chi_cal_counts(counts)
 
         return cuts
 
@@ -105,30 +225,40 @@ class bins_method_funcs(object):
         给予字符串变量可比较性；
         strs2orders : 一个字典包含对应的字符串与数值对应关系
         """
-        self.raw = self.raw.assign(**{self.ft_name:self.raw[self.ft_name].apply(lambda x: strs2orders[x] if x in strs2orders.keys() else None)})
+        self.raw = self.raw.assign(**{self.ft_name:tools.dict_map(self.raw[self.ft_name], strs2orders)})
+        self.prep = None
         if ifraise:
             if self.raw[self.ft_name].isna().max() == True:
                 raise ValueError('setStrValue: new value happened!')
 
 
-    def _smpSizeCheck_real(self, tmp, prm_cuts, smp_size):
-        tmp['grp'] = pd.cut(tmp[self.ft_name], bins = prm_cuts, labels = range(len(prm_cuts)-1), right = False)
-        stat = tmp[['grp', self.ft_name]].groupby('grp', as_index = True).count()
+    def _smpSizeCheck_real(self, prm_cuts, smp_size):
+        """
+        检查各分组的样本数，样本数过少的分组与相邻分组合并
+        各分组样本数由预处理的排序数组一次得到，之后的合并只在样本数数组上进行
+        """
+        stat = self._prep_count_table(prm_cuts).sum(axis = 1)
 
         #最后检查分组后分组样本的占比情况，当样本个数欧过少时合并
-        while stat[self.ft_name].min() < smp_size:
-            tgt_loc = np.argmin(stat[self.ft_name])
+        while len(stat) > 0 and stat.min() < smp_size:
+            tgt_loc = np.argmin(stat)
             if tgt_loc == 0:
-                prm_cuts.remove(prm_cuts[tgt_loc+1])
+                rm_loc = tgt_loc+1
             elif tgt_loc == len(prm_cuts)-2:
-                prm_cuts.remove(prm_cuts[tgt_loc-1])
-            elif stat.loc[tgt_loc-1,self.ft_name] < stat.loc[tgt_loc+1, self.ft_name]:
-                prm_cuts.remove(prm_cuts[tgt_loc])
+                rm_loc = tgt_loc-1
+            elif stat[tgt_loc-1] < stat[tgt_loc+1]:
+                rm_loc = tgt_loc
             else:
-                prm_cuts.remove(prm_cuts[tgt_loc+1])
-
-            tmp = tmp.assign(grp=pd.cut(tmp[self.ft_name], bins = prm_cuts, labels = range(len(prm_cuts)-1), right = False))
-            stat = tmp[['grp', self.ft_name]].groupby('grp', as_index = True).count()
+                rm_loc = tgt_loc+1
+
+            prm_cuts.remove(prm_cuts[rm_loc])
+            #删除首尾分割点时对应分组的样本不再计入，否则合并两侧的分组
+            if rm_loc == 0:
+                stat = stat[1:]
+            elif rm_loc == len(stat):
+                stat = stat[:-1]
+            else:
+                stat = self._merge_count_table(stat, rm_loc-1)
 
         return prm_cuts
 
@@ -206,35 +336,100 @@ class bins_method_funcs(object):
         else:
             self.woe_check = {}
 
+    def _tree_impurity(self, n, bad, criterion = 'gini'):
+        """
+        与sklearn一致的节点不纯度计算，n、bad可以是数组
+        """
+        n = np.asarray(n, dtype = float)
+        good = n - bad
+        if criterion == 'gini':
+            return 1.0 - (good * good + bad * bad) / (n * n)
+        elif criterion == 'entropy':
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                entropy = 0.0
+                for cnt in [good, bad]:
+                    pct = cnt / n
+                    entropy = entropy - np.where(cnt > 0, pct * (np.log(pct) / np.log(2.0)), 0.0)
+            return entropy
+        else:
+            raise ValueError('Invalid Input Criterion')
+
+    def _tree_split_cuts(self, vals, cum_bad, min_samples_leaf, max_leaf_nodes = None, criterion = 'gini', cum_n = None):
+        """
+        一维的最优分割决策树，结果与sklearn中DecisionTreeClassifier(min_samples_leaf, max_leaf_nodes)一致：
+        1.vals为排序后的特征取值，cum_bad为对应的累计bad样本数（即_getPrep的结果）；
+        2.与sklearn一样在float32精度上比较取值，相差不超过1e-7的相邻取值不做分割；
+        3.只在相邻可分割取值之间的累计好坏样本数上计算不纯度，按不纯度下降最多的节点优先分割；
+        cum_n：分组计数形式的累计样本数，与_getPrep一致
+        返回每个叶子节点的第一个取值，即分割点（不含最大值）
+        """
+        epsilon = np.finfo('double').eps
+        x32 = vals.astype(np.float32)
+        #可分割位置，位置p表示在第p个样本之前分割
+        pos = np.r_[0, np.flatnonzero(x32[1:] > x32[:-1] + np.float32(1e-7)) + 1, len(vals)]
+        cum_b = cum_bad[pos].astype(float)
+        cum_n = (pos if cum_n is None else cum_n[pos]).astype(float)
+        n_total = cum_n[-1]
+
+        def node_split(s, e, impurity):
+            n_node = cum_n[e] - cum_n[s]
+            if n_node < 2 or n_node < 2 * min_samples_leaf or impurity <= epsilon or e - s < 2:
+                return None
+            n_l = cum_n[s+1:e] - cum_n[s]; b_l = cum_b[s+1:e] - cum_b[s]
+            n_r = n_node - n_l; b_r = (cum_b[e] - cum_b[s]) - b_l
+            vld = np.flatnonzero((n_l >= min_samples_leaf) & (n_r >= min_samples_leaf))
+            if len(vld) == 0:
+                return None
+            imp_l = self._tree_impurity(n_l[vld], b_l[vld], criterion)
+            imp_r = self._tree_impurity(n_r[vld], b_r[vld], criterion)
+            best = np.argmax(- n_r[vld] * imp_r - n_l[vld] * imp_l)
+            k = s + 1 + vld[best]
+            imp_l, imp_r, nl, nr = imp_l[best], imp_r[best], n_l[vld][best], n_r[vld][best]
+            improvement = (n_node / n_total) * (impurity - (nr / n_node * imp_r) - (nl / n_node * imp_l))
+            if improvement + epsilon < 0:
+                return None
+            return improvement, k, imp_l, imp_r
+
+        root_imp = self._tree_impurity(n_total, cum_b[-1], criterion)
+        frontier = [(0, len(pos)-1, node_split(0, len(pos)-1, root_imp))]
+        splits = []
+        max_split_nodes = np.inf if max_leaf_nodes is None else max_leaf_nodes - 1
+        while len(frontier) > 0:
+            #优先分割不纯度下降最多的节点，叶子节点的下降视为0
+            loc = int(np.argmax([-1 if a[2] is None else a[2][0] for a in frontier]))
+            s, e, split = frontier.pop(loc)
+            if split is None or max_split_nodes <= 0:
+                continue
+            max_split_nodes -= 1
+            _, k, imp_l, imp_r = split
+            splits += [k]
+            frontier += [(s, k, node_split(s, k, imp_l)), (k, e, node_split(k, e, imp_r))]
+
+        splits.sort()
+        return list(vals[[0] + [pos[k] for k in splits]])
+
     def tree_bins_func(self, grps = None, pct_size = None):
         """
         基于决策树（信息熵）的分组
         1.max_grps控制最大分组的个数；
         2.pct_size控制每组最低的样本占比
         """
-        tmp = self.raw.copy().dropna()
+        prep = self._getPrep()
         if pct_size is None:
-            smp_size = np.int(len(tmp)*self.argms['pct_size'])+1
+            smp_size = np.int(self._prep_size()*self.argms['pct_size'])+1
         else:
-            smp_size = np.int(len(tmp)*pct_size)+1
+            smp_size = np.int(self._prep_size()*pct_size)+1
         if grps is None:
             grps = self.argms['max_grps']
 
         #当特征的最大取值占比超过阈值时，不做进一步区分，只分为2组
-        #以决策树为分组的基准工具
-        clf = DecisionTreeClassifier(min_samples_leaf = smp_size, max_leaf_nodes = grps)
-        clf.fit(tmp[[self.ft_name]], tmp['label'])
-
-        tmp['grp_prd'] = clf.apply(tmp[[self.ft_name]])
-
-        grp_info = tmp.groupby('grp_prd').min()
-        grp_info.sort_values(self.ft_name, inplace = True, ascending = True)
-        cuts = list(grp_info[self.ft_name]) + [tmp[self.ft_name].max()+1]
+        #以一维决策树为分组的基准工具，直接在累计好坏样本数上寻找分割点
+        cuts = self._tree_split_cuts(prep['vals'], prep['cum_bad'], smp_size, grps, cum_n = prep['cum_n']) + [prep['max']+1]
 
-        cuts = self._smpSizeCheck_real(tmp, cuts, smp_size)
+        cuts = self._smpSizeCheck_real(cuts, smp_size)
 
         self.bins = {self.ft_name:cuts}
-        self.cap_info = {'max': tmp[self.ft_name].max(), 'min':tmp[self.ft_name].min()}
+        self.cap_info = {'max': prep['max'], 'min':prep['min']}
         if len(cuts) == 2:
             self.woe_check = {self.ft_name: 'tree_bins_func_failed!-value biased'}
         else:
@@ -259,18 +454,18 @@ class bins_method_funcs(object):
         if pct_size is None:
             pct_size = self.argms['pct_size']
 
-        tmp = self.raw.copy().dropna()
+        prep = self._getPrep()
         #在已知分组数的前提下，允许任意分组样本占总体样本向下浮动一定的比例
         pct_size = min(pct_size, 1.0/grps/1.5)
-        smp_size = np.int(len(tmp)*pct_size)+1
+        smp_size = np.int(self._prep_size()*pct_size)+1
 
-        prm_cuts = [tmp[self.ft_name].quantile(1.0/grps * a, interpolation = 'lower') for a in range(grps)]
-        prm_cuts += [tmp[self.ft_name].max()+1]
+        prm_cuts = [self._prep_quantile(1.0/grps * a) for a in range(grps)]
+        prm_cuts += [prep['max']+1]
 
         prm_cuts = list(set(prm_cuts))
         prm_cuts.sort()
 
-        prm_cuts = self._smpSizeCheck_real(tmp, prm_cuts, smp_size)
+        prm_cuts = self._smpSizeCheck_real(prm_cuts, smp_size)
         # tmp['grp'] = pd.cut(tmp[self.ft_name], bins = prm_cuts, index = range(len(prm_cuts)-1), right = False)
         # stat = tmp[['grp', self.ft_name]].groupby('grp', as_index = True).count()
         #
@@ -292,7 +487,7 @@ class bins_method_funcs(object):
         #     stat = tmp[['grp', self.ft_name]].groupby('grp', as_index = True).count()
 
         self.bins = {self.ft_name:prm_cuts}
-        self.cap_info = {'max': tmp[self.ft_name].max(), 'min':tmp[self.ft_name].min()}
+        self.cap_info = {'max': prep['max'], 'min':prep['min']}
         if len(prm_cuts) == 2:
             self.woe_check = {self.ft_name: 'freq_bins_func_failed!-value biased'}
         else:
@@ -307,21 +502,22 @@ class bins_method_funcs(object):
         3.pct_size控制最小分组样本占整体的最小比例；
         4.pv控制是否合并分箱的阈值
         """
-        tmp = self.raw.copy().dropna()
+        prep = self._getPrep()
         if grps is None:
             grps = self.argms['max_grps']
         pv = self.argms['chiq_pv']
         if pct_size is None:
-            smp_size = np.int(len(tmp)*self.argms['pct_size'])+1
+            smp_size = np.int(self._prep_size()*self.argms['pct_size'])+1
         else:
-            smp_size = np.int(len(tmp)*pct_size)+1
+            smp_size = np.int(self._prep_size()*pct_size)+1
 
         #先使用均匀分组当方式分割为20组
         self.freq_bins_func(grps = 20, pct_size = 0.03)
 
         cuts = self.getWoeBins()
-        tmp['grp'] = pd.cut(tmp[self.ft_name], bins = cuts, labels = range(len(cuts)-1), right = False)
-        chis = self._chi_cal_func(tmp)
+        #分组计数只统计一次，之后的合并只在计数表上进行
+        counts = self._prep_count_table(cuts)
+        chis = self._chi_cal_counts(counts)
         if len(cuts) > 2:
         #以卡方为基准进行分箱合并
             while max(chis) > pv or len(cuts)-1>grps:
@@ -329,15 +525,14 @@ class bins_method_funcs(object):
                     break
                 tgt = chis.index(max(chis))
                 cuts.remove(cuts[tgt+1])
-                #tmp['grp'] = pd.cut(tmp[self.ft_name], bins = cuts, index = range(len(cuts)-1), right = False)
-                tmp = tmp.assign(grp = pd.cut(tmp[self.ft_name], bins = cuts, labels = range(len(cuts)-1), right = False))
-                chis = self._chi_cal_func(tmp)
+                counts = self._merge_count_table(counts, tgt)
+                chis = self._chi_cal_counts(counts)
 
-            cuts = self._smpSizeCheck_real(tmp, cuts, smp_size)
+            cuts = self._smpSizeCheck_real(cuts, smp_size)
 
 
         self.bins = {self.ft_name:cuts}
-        self.cap_info = {'max': tmp[self.ft_name].max(), 'min':tmp[self.ft_name].min()}
+        self.cap_info = {'max': prep['max'], 'min':prep['min']}
         if len(cuts) == 2:
             self.woe_check = {self.ft_name: 'chiq_bins_func_failed!-value biased'}
         else:
@@ -350,11 +545,9 @@ class bins_method_funcs(object):
         """
         bins = self.bins[self.ft_name]
 
-        tmp = self.raw.dropna()
-
-        #tmp.loc[:,self.ft_name] = tmp[self.ft_name].apply(self._llt_cap_func, s = self.cap_info['min'], b = self.cap_info['max'])
-        tmp = tmp.assign(**{self.ft_name: tmp[self.ft_name].apply(self._llt_cap_func, s = self.cap_info['min'], b = self.cap_info['max'])})
-        cuts = self._bins_merge_chiq(tmp, bins)
+        #截断后的分组计数直接由预处理的排序数组得到
+        counts = self._prep_count_table(bins, cap_info = self.cap_info)
+        cuts = self._bins_merge_chiq_counts(counts, bins)
         self.bins = {self.ft_name:cuts}
         if len(cuts) == 2:
             self.woe_check = {self.ft_name: 'mono_bins_func_failed!-value biased'}
@@ -391,6 +584,7 @@ class WoeFuncs(bins_method_funcs):
         """
         self.raw = df
         self.ft_name = list(self.raw.columns.values)[0]
+        self.prep = None
         try:
             self.woeDetail[self.ft_name]['bins']
         except:
@@ -404,26 +598,12 @@ class WoeFuncs(bins_method_funcs):
         3.keepnan: 控制是否进行空值处理；
         4.methods: 控制分箱方法，只有‘tree’， ‘chiq’， ‘freq’三种可选；
         """
-        methods = self.methods
         keepnan = self.keepnan
 
         if data is None:
             data = self.raw.copy()
 
-        try:
-            bins = self.bins[self.ft_name]
-        except:
-            if methods == 'tree':
-                self.tree_bins_func()
-            elif methods == 'chiq':
-                self.chiq_bins_func()
-            elif methods == 'freq':
-                self.freq_bins_func()
-            else:
-                raise ValueError('Invalid Input Methods')
-
-        if self.ifmono:
-            self.mono_bins_func()
+        self._woe_bins_cal()
 
         bins = self.bins[self.ft_name]
         cap_info = self.cap_info
@@ -439,6 +619,33 @@ class WoeFuncs(bins_method_funcs):
             rlts = np.array(stat).tolist() + [['nan', data[data[self.ft_name].isna()]['label'].sum(), len(data[data[self.ft_name].isna()])]]
         else:
             rlts = np.array(stat).tolist()
+
+        self._woe_info_set(rlts)
+
+    def _woe_bins_cal(self):
+        """
+        按分箱方法计算分组，已有分组时沿用，ifmono时再做单调性合并
+        """
+        methods = self.methods
+        try:
+            bins = self.bins[self.ft_name]
+        except:
+            if methods == 'tree':
+                self.tree_bins_func()
+            elif methods == 'chiq':
+                self.chiq_bins_func()
+            elif methods == 'freq':
+                self.freq_bins_func()
+            else:
+                raise ValueError('Invalid Input Methods')
+
+        if self.ifmono:
+            self.mono_bins_func()
+
+    def _woe_info_set(self, rlts):
+        """
+        根据各分组的[分组名称, bad, size]计算WOE及IV，并记录至woeDetail及iv_stat
+        """
         woe = pd.DataFrame(rlts, columns = [self.ft_name, 'bad', 'size'])
 
         #IV及woe值的计算
@@ -459,6 +666,36 @@ class WoeFuncs(bins_method_funcs):
         self.iv_stat['woe_info'] = woe
         self.iv_stat['iv_value'] = woe['iv'].sum()
 
+    def setPrep(self, ft_name, prep):
+        """
+        直接设定特征的分组计数形式表示，用于无法一次读入内存的数据，之后使用woe_cal_prep计算
+        prep包含vals, cum_n, cum_bad, min, max，含义与_getPrep一致
+        """
+        self.raw = None
+        self.ft_name = ft_name
+        self.prep = prep
+        try:
+            self.woeDetail[self.ft_name]['bins']
+        except:
+            self.woeDetail[self.ft_name] = {}
+
+    def woe_cal_prep(self, nan_stat = None):
+        """
+        基于setPrep设定的分组计数计算分组、WOE编码及IV，结果与woe_cal的记录方式一致
+        nan_stat：空值样本的[bad, size]
+        """
+        self._woe_bins_cal()
+        bins = self.bins[self.ft_name]
+
+        counts = self._prep_count_table(bins, cap_info = self.cap_info)
+        labels = [str(a) for a in pd.cut(pd.Series([], dtype = float), bins = bins, right = False).cat.categories]
+        #与woe_cal中按分组groupby的结果一致，按分组顺序且包含空分组
+        rlts = [[labels[a], int(counts[a, 1]), int(counts[a].sum())] for a in range(len(labels))]
+        if self.keepnan and nan_stat is not None and nan_stat[1] > 0:
+            rlts += [['nan', int(nan_stat[0]), int(nan_stat[1])]]
+
+        self._woe_info_set(rlts)
+
     def strWoe_cal(self, data = None, cuts = None, keepnan = True):
         """
         对于定性类的特征进行woe计算
@@ -480,7 +717,7 @@ class WoeFuncs(bins_method_funcs):
         cuts = self._strWoe_merge(tmp.dropna(), self.ft_name, cuts, self.argms['max_grps'])
         self.setWoeBins({self.ft_name:cuts})
 
-        tmp['grp'] = tmp[self.ft_name].apply(lambda x: cuts[x] if x in cuts.keys() else 'nan')
+        tmp['grp'] = tools.dict_map(tmp[self.ft_name], cuts, 'nan')
         if not keepnan:
             tmp = tmp[tmp['grp']!='nan']
 
@@ -513,7 +750,7 @@ class WoeFuncs(bins_method_funcs):
         对于分类型特征进行基于iv值的合并，需要提供特征名称，对应的原始分组，最大分组数
         同时需要根据最小分组的占比
         """
-        df['grp'] = df[ft_name].apply(lambda x: org_bins[x] if x in org_bins.keys() else None)
+        df['grp'] = tools.dict_map(df[ft_name], org_bins)
         df = df[~df['grp'].isna()]
 
         woe = df[['grp', 'label']].groupby('grp', as_index = False).agg({'label':['sum', 'count']})
@@ -530,7 +767,7 @@ class WoeFuncs(bins_method_funcs):
                 if v == m1:
                     org_bins[k] = m2
             #df['grp'] = df[ft_name].apply(lambda x: org_bins[x] if x in org_bins.keys() else 'nan')
-            df = df.assign(grp = df[ft_name].apply(lambda x: org_bins[x] if x in org_bins.keys() else 'nan'))
+            df = df.assign(grp = tools.dict_map(df[ft_name], org_bins, 'nan'))
             woe = df[['grp', 'label']].groupby('grp', as_index = False).agg({'label':['sum', 'count']})
             woe.columns = [ft_name, 'bad', 'size']
             woe['bad_pct'] = woe['bad']/woe['size']
@@ -539,9 +776,57 @@ class WoeFuncs(bins_method_funcs):
 
         return org_bins
 
-    def woe_apply(self, data = None, keepnan = True):
+    def _woe_cal_one(self, ft_name, type_info):
+        """
+        根据特征类型计算单个特征的WOE，需先调用setTgt
+        type_info：'str'，'int'/'float'，或者字符串与数值对应关系的字典
+        """
+        if type_info == 'str':
+            self.strWoe_cal()
+        elif type_info in ['int', 'float']:
+            self.woe_cal()
+        elif isinstance(type_info, dict):
+            self._setStrValue(type_info, ifraise = False)
+            self.woeDetail[ft_name]['str2orders'] = type_info
+            self.woe_cal()
+
+    def _woe_arrays(self, cuts, woe_info):
+        """
+        将分箱及WOE编码整理为数组，供woe_apply的快速模式使用
+        返回分割点数组，以及长度为分组数+1的WOE数组与有效标记，最后一位对应‘nan’分组
+        分组名称与pd.cut生成的区间字符串保持一致
+        """
+        cuts_arr = np.asarray(cuts, dtype = float)
+        labels = [str(a) for a in pd.cut(pd.Series([], dtype = float), bins = cuts, right = False).cat.categories] + ['nan']
+
+        woes_arr = np.array([woe_info.get(a, np.nan) for a in labels], dtype = float)
+        valid_arr = np.array([a in woe_info.keys() for a in labels])
+
+        return cuts_arr, woes_arr, valid_arr
+
+    def _woe_codes(self, vals, cuts, woe_info):
+        """
+        woe_apply的向量化实现：np.clip截断，np.searchsorted定位分组，一次数组索引取得WOE
+        与_llt_cap_func保持一致，空值会被截断至最小分割点
+        vals：特征取值数组，返回对应的WOE数组
+        """
+        cuts_arr, woes_arr, valid_arr = self._woe_arrays(cuts, woe_info)
+        floor, up = cuts_arr[0], cuts_arr[-1]
+
+        vals = np.asarray(vals, dtype = float)
+        vals = np.clip(np.where(np.isnan(vals), floor, vals), floor, up)
+        #等于最大分割点的取值落在区间外，对应‘nan’分组
+        grp = np.searchsorted(cuts_arr, vals, side = 'right') - 1
+
+        if not valid_arr[grp].all():
+            raise KeyError('nan value happened in test!')
+
+        return woes_arr[grp]
+
+    def woe_apply(self, data = None, keepnan = True, fast = False):
         """
         用WOE编码替换分组信息
+        fast：是否使用向量化的快速模式，结果与默认模式一致
         """
         if data is None:
             data = self.raw.copy()
@@ -557,6 +842,10 @@ class WoeFuncs(bins_method_funcs):
             cuts = self.woeDetail[self.ft_name]['bins']
             woe_info = self.woeDetail[self.ft_name]['woes']
 
+        if fast:
+            self.woe_coded_data = data.assign(**{self.ft_name:self._woe_codes(data[self.ft_name].values, cuts, woe_info)})
+            return
+
         up, floor = max(cuts), min(cuts)
 
         data['grp'] = pd.cut(data[self.ft_name].apply(self._llt_cap_func, s = floor, b = up), bins = cuts, right = False).astype(object).apply(str)
@@ -605,6 +894,20 @@ class WoeFuncs(bins_method_funcs):
     def getInvalid(self):
         return {k:v for k, v in self.allInvalid.items() if v is not None}
 
+    def getBinStats(self):
+        """
+        将当前特征的分组统计转换为binStats，用于之后的增量更新或多进程合并
+        """
+        detail = self.woeDetail[self.ft_name]
+        stats = binStats(self.ft_name, detail['bins'], str2orders = detail.get('str2orders'))
+        loc = {str(v):k for k, v in enumerate(stats.labels)}
+        for row in self.iv_stat['woe_info'][[self.ft_name, 'bad', 'size']].values:
+            if str(row[0]) == 'nan':
+                stats.nan_bad += int(row[1]); stats.nan_good += int(row[2] - row[1])
+            else:
+                stats.bad[loc[str(row[0])]] += int(row[1]); stats.good[loc[str(row[0])]] += int(row[2] - row[1])
+        return stats
+
     def freeMmy(self):
         try:
             del self.raw
@@ -616,6 +919,207 @@ class WoeFuncs(bins_method_funcs):
         except:
             pass
 
+def _AllWoeCals_worker(params, data, ftrs, woeDetail):
+    """
+    AllWoeCals多进程模式的子进程任务
+    data只包含本组特征及label，ftrs为本组特征的类型信息，woeDetail为本组特征已有的WOE信息
+    """
+    spurs = WoeFuncs(**params)
+    spurs.woeDetail = woeDetail
+    ivs = {}
+    for i in ftrs.keys():
+        spurs.setTgt(data[[i, 'label']])
+        spurs._woe_cal_one(i, ftrs[i])
+        ivs[i] = spurs.getIVinfo()
+
+    return ivs, spurs.woeDetail, spurs.allInvalid
+
+class binStats(object):
+    """
+    单个特征的分组计数，可序列化并支持累加、合并与相减：
+    1.bins为数值型特征的分割点，或者定性特征的类别与分组对应关系（与woeDetail中的bins一致）；
+    2.str2orders不为空时，先将字符串转换为对应数值再分组；
+    3.bad, good为各分组的好坏样本数，nan_bad, nan_good为空值及未知类别的好坏样本数；
+    4.WOE、IV、bad_pct均由计数直接计算，无需原始数据
+    toDict的结果可以直接作为参数重新构建对象
+    """
+    def __init__(self, ft_name, bins, bad = None, good = None, nan_bad = 0, nan_good = 0, str2orders = None):
+        self.ft_name = ft_name
+        self.bins = bins
+        self.str2orders = str2orders
+        if isinstance(bins, dict):
+            self.groups = sorted(set(bins.values()))
+            self.labels = self.groups
+        else:
+            self.groups = None
+            self.labels = [str(a) for a in pd.cut(pd.Series([], dtype = float), bins = bins, right = False).cat.categories]
+
+        self.bad = np.zeros(len(self.labels), dtype = np.int64) if bad is None else np.array(bad, dtype = np.int64)
+        self.good = np.zeros(len(self.labels), dtype = np.int64) if good is None else np.array(good, dtype = np.int64)
+        self.nan_bad = int(nan_bad)
+        self.nan_good = int(nan_good)
+
+    def _grp_index(self, vals):
+        """
+        特征取值对应的分组位置，空值及未知类别为-1
+        """
+        if self.groups is None:
+            if self.str2orders is not None:
+                vals = tools.dict_map(vals, self.str2orders)
+            vals = np.asarray(vals, dtype = float)
+            #超出分割点范围的取值归入首尾分组
+            grp = np.clip(np.searchsorted(np.asarray(self.bins, dtype = float), vals, side = 'right') - 1, 0, len(self.labels)-1)
+            return np.where(np.isnan(vals), -1, grp)
+        else:
+            grp = vals.map(self.bins)
+            return np.where(grp.isna(), -1, np.searchsorted(self.groups, grp.fillna(self.groups[0]).values))
+
+    def add(self, df):
+        """
+        累加新数据的分组计数，df的第一列为特征，第二列为label
+        """
+        grp = self._grp_index(df.iloc[:, 0])
+        label = df.iloc[:, 1].values
+        self.bad += np.bincount(grp[(grp >= 0) & (label == 1)], minlength = len(self.labels))
+        self.good += np.bincount(grp[(grp >= 0) & (label == 0)], minlength = len(self.labels))
+        self.nan_bad += int(((grp < 0) & (label == 1)).sum())
+        self.nan_good += int(((grp < 0) & (label == 0)).sum())
+        return self
+
+    def _check(self, other):
+        if self.ft_name != other.ft_name or self.bins != other.bins:
+            raise ValueError('binStats: bins not match!')
+
+    def merge(self, other):
+        """
+        合并另一份相同分组的计数，例如多个进程或多个月份的结果
+        """
+        self._check(other)
+        self.bad += other.bad; self.good += other.good
+        self.nan_bad += other.nan_bad; self.nan_good += other.nan_good
+        return self
+
+    def subtract(self, other):
+        """
+        减去另一份相同分组的计数，例如移出最早月份的数据
+        """
+        self._check(other)
+        if (self.bad < other.bad).any() or (self.good < other.good).any() or self.nan_bad < other.nan_bad or self.nan_good < other.nan_good:
+            raise ValueError('binStats: negative counts after subtract!')
+        self.bad -= other.bad; self.good -= other.good
+        self.nan_bad -= other.nan_bad; self.nan_good -= other.nan_good
+        return self
+
+    def copy(self):
+        return binStats(**self.toDict())
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def __sub__(self, other):
+        return self.copy().subtract(other)
+
+    def _woe_arrays(self, keepnan = True):
+        """
+        各分组（keepnan时最后一位为空值分组）的bad, good, woe, iv
+        """
+        if keepnan and self.nan_bad + self.nan_good > 0:
+            bad = np.append(self.bad, self.nan_bad).astype(float); good = np.append(self.good, self.nan_good).astype(float)
+        else:
+            bad = self.bad.astype(float); good = self.good.astype(float)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            woe = np.log((bad/bad.sum())/(good/good.sum()))
+            iv = (bad/bad.sum() - good/good.sum()) * woe
+        return bad, good, woe, iv
+
+    def getWoeInfo(self, keepnan = True):
+        """
+        与WoeFuncs.getWoeInfo格式一致的分组统计
+        """
+        bad, good, woe, iv = self._woe_arrays(keepnan)
+        labels = self.labels + ['nan'] if len(bad) > len(self.labels) else self.labels
+        info = pd.DataFrame({self.ft_name:labels, 'bad':bad, 'size':bad + good, 'good':good, 'woe':woe, 'iv':iv})
+        info['bad_pct'] = info['bad']/info['size']
+        return info
+
+    def getIVinfo(self, keepnan = True):
+        return np.nansum(self._woe_arrays(keepnan)[3])
+
+    def getWoes(self, keepnan = True):
+        """
+        与woeDetail中woes格式一致的WOE编码
+        """
+        woe = self._woe_arrays(keepnan)[2]
+        if self.groups is None:
+            woes = {self.labels[a]:woe[a] for a in range(len(self.labels))}
+        else:
+            woes = {k:woe[self.groups.index(v)] for k, v in self.bins.items()}
+        if len(woe) > len(self.labels):
+            woes['nan'] = woe[-1]
+        return woes
+
+    def toDict(self):
+        return {'ft_name':self.ft_name, 'bins':self.bins, 'bad':self.bad.tolist(), 'good':self.good.tolist(), \
+                'nan_bad':self.nan_bad, 'nan_good':self.nan_good, 'str2orders':self.str2orders}
+
+class quantileSketch(object):
+    """
+    可合并的近似分位数摘要，用于分块读取无法一次读入内存的数据：
+    1.每个数据块只保留size个顺序统计量及其代表的样本数；
+    2.累计超过2*size个点时按权重压缩回size个点；
+    3.最小值、最大值及样本数是精确的
+    """
+    def __init__(self, size = 200):
+        self.size = size
+        self.points = None
+        self.weights = None
+        self.min = None
+        self.max = None
+        self.count = 0
+
+    def update(self, values):
+        """
+        values：不含空值的特征取值
+        """
+        values = np.sort(np.asarray(values), kind = 'mergesort')
+        if len(values) == 0:
+            return self
+        if len(values) > self.size:
+            locs = ((np.arange(self.size) + 0.5) * len(values) / self.size).astype(int)
+            points, weights = values[locs], np.full(self.size, len(values) / self.size)
+        else:
+            points, weights = values, np.ones(len(values))
+        self._add(points, weights, values[0], values[-1], len(values))
+        return self
+
+    def merge(self, other):
+        if other.count > 0:
+            self._add(other.points, other.weights, other.min, other.max, other.count)
+        return self
+
+    def _add(self, points, weights, min_v, max_v, count):
+        if self.points is None:
+            self.points, self.weights = points, weights
+            self.min, self.max = min_v, max_v
+        else:
+            self.points = np.concatenate([self.points, points])
+            self.weights = np.concatenate([self.weights, weights])
+            self.min, self.max = min(self.min, min_v), max(self.max, max_v)
+        self.count += count
+
+        if len(self.points) > 2 * self.size:
+            order = np.argsort(self.points, kind = 'mergesort')
+            points, cum_w = self.points[order], np.cumsum(self.weights[order])
+            locs = np.searchsorted(cum_w, (np.arange(self.size) + 0.5) * cum_w[-1] / self.size, side = 'left')
+            self.points = points[np.minimum(locs, len(points)-1)]
+            self.weights = np.full(self.size, cum_w[-1] / self.size)
+
+    def getQuantiles(self, qs):
+        order = np.argsort(self.points, kind = 'mergesort')
+        points, cum_w = self.points[order], np.cumsum(self.weights[order])
+        locs = np.searchsorted(cum_w, np.asarray(qs) * cum_w[-1], side = 'left')
+        return points[np.minimum(locs, len(points)-1)]
+
 class AllWoeFuncs(WoeFuncs):
     """docstring for AllWoeFUncs:
        1.check setFtrs and setData functions before any calculation
@@ -645,36 +1149,226 @@ class AllWoeFuncs(WoeFuncs):
         else:
             self.woeDetail = tools.getJson(self.path+'/feature_process_methods/IVstat/woeDetail_'+woe_vrs_info+'.json')
 
-    def AllWoeCals(self, vrs = None):
+    def AllWoeCals(self, vrs = None, n_jobs = None):
         """
         vrs for version control
+        n_jobs：多进程计算的进程数，None或1时逐个特征计算，-1时使用全部CPU
+        多进程时特征按顺序切分，每个进程只接收对应特征及label列，结果按原特征顺序合并
+        """
+        if n_jobs is not None and n_jobs < 0:
+            n_jobs = os.cpu_count()
+
+        if n_jobs is None or n_jobs <= 1:
+            ivs = {}
+            try:
+                with tqdm(self.ftrs.keys()) as t:
+                    for i in t:
+                        self.setTgt(self.data[[i, 'label']])
+                        self._woe_cal_one(i, self.ftrs[i])
+                        ivs[i] = self.getIVinfo()
+            except KeyboardInterrupt:
+                t.close()
+                raise
+            t.close()
+        else:
+            ivs = self._AllWoeCals_parallel(n_jobs)
+
+        if vrs is not None:
+
+            tools.putFile(self.path+'/feature_process_methods/IVstat','IVs_'+vrs+'.json', ivs)
+            tools.putFile(self.path+'/feature_process_methods/IVstat','woeDetail_'+vrs+'.json', self.woeDetail)
+
+    def _streamValues(self, chunk, i, type_info):
+        """
+        分块读取时取出特征取值，字典类型的特征先转换为对应的数值
         """
+        if isinstance(type_info, dict):
+            return tools.dict_map(chunk[i], type_info)
+        return chunk[i]
+
+    def AllWoeCals_stream(self, file, ftrs = None, vrs = None, chunksize = 100000, sketch_size = 200, **read_params):
+        """
+        分两次分块读取csv文件计算WOE及IV，内存占用与文件大小无关：
+        1.第一次读取为每个特征建立近似分位数摘要，以摘要的分位点作为细分组；
+        2.第二次读取精确统计各细分组及空值的好坏样本数；
+        3.在细分组计数上按methods分箱，最终分组由细分组合并而来，WOE及IV是精确的
+        ftrs：与setFtrs一致，只支持'int'，'float'及字典类型的特征，'str'类型的特征会被跳过
+        sketch_size：细分组个数的上限，越大分箱越接近全量计算的结果
+        read_params：传递给pd.read_csv的其他参数
+        """
+        if ftrs is None:
+            ftrs = self.ftrs
+        skipped = [k for k, v in ftrs.items() if not (isinstance(v, dict) or v in ['int', 'float'])]
+        if len(skipped) > 0:
+            warnings.warn('features skipped in stream mode: %s' % ','.join(skipped))
+        #过滤后的特征只在本函数中使用，不修改self.ftrs
+        ftrs = {k:v for k, v in ftrs.items() if k not in skipped}
+
+        def chunks():
+            return pd.read_csv(file, chunksize = chunksize, usecols = list(ftrs.keys()) + ['label'], **read_params)
+
+        #第一次读取：近似分位数摘要
+        sketches = {i:quantileSketch(sketch_size) for i in ftrs.keys()}
+        for chunk in tqdm(chunks()):
+            chunk = chunk[chunk['label'].notna()]
+            for i in ftrs.keys():
+                sketches[i].update(self._streamValues(chunk, i, ftrs[i]).dropna().values)
+
+        edges = {}
+        for i in ftrs.keys():
+            skt = sketches[i]
+            if skt.count == 0:
+                continue
+            edge = np.unique(np.r_[skt.min, skt.getQuantiles(np.arange(1, sketch_size) / sketch_size)]).astype(skt.points.dtype)
+            edges[i] = np.r_[edge, edge.dtype.type(skt.max)+1]
+
+        #第二次读取：各细分组及空值的好坏样本数
+        counts = {i:np.zeros((len(edges[i])-1, 2), dtype = np.int64) for i in edges.keys()}
+        nan_stat = {i:np.zeros(2, dtype = np.int64) for i in ftrs.keys()}
+        for chunk in tqdm(chunks()):
+            chunk = chunk[chunk['label'].notna()]
+            label = chunk['label'].values
+            for i in ftrs.keys():
+                vals = self._streamValues(chunk, i, ftrs[i]).values
+                isna = pd.isna(vals)
+                nan_stat[i] += [(label[isna] == 1).sum(), isna.sum()]
+                if i in edges.keys():
+                    counts[i] += self._bins_count_table(vals[~isna], label[~isna], edges[i])
+
         ivs = {}
+        for i in tqdm(ftrs.keys()):
+            if i not in edges.keys():
+                warnings.warn('%s has no valid values' % i)
+                continue
+            #只保留非空的细分组，每个细分组以其最小值（即分位点）表示
+            vld = counts[i].sum(axis = 1) > 0
+            edge = edges[i][:-1]
+            dtype = sketches[i].points.dtype
+            prep = {'vals':edge[vld], 'cum_n':np.r_[0, np.cumsum(counts[i][vld].sum(axis = 1))], \
+                    'cum_bad':np.r_[0, np.cumsum(counts[i][vld, 1])], 'min':dtype.type(sketches[i].min), 'max':dtype.type(sketches[i].max)}
+            self.setPrep(i, prep)
+            if isinstance(ftrs[i], dict):
+                self.woeDetail[i]['str2orders'] = ftrs[i]
+            self.woe_cal_prep(nan_stat[i])
+            ivs[i] = self.getIVinfo()
+
+        if vrs is not None:
+
+            tools.putFile(self.path+'/feature_process_methods/IVstat','IVs_'+vrs+'.json', ivs)
+            tools.putFile(self.path+'/feature_process_methods/IVstat','woeDetail_'+vrs+'.json', self.woeDetail)
+
+    def AllBinStats(self, vrs = None):
+        """
+        按woeDetail中已有的分组统计当前数据的分组计数，返回各特征的binStats
+        新增一个月的数据时，将该结果与历史的binStats合并后使用AllWoeRefresh更新WOE
+        """
+        stats = {}
         try:
-            with tqdm(self.ftrs.keys()) as t:
+            with tqdm(self.woeDetail.keys()) as t:
                 for i in t:
-                    self.setTgt(self.data[[i, 'label']])
-                    if self.ftrs[i] == 'str':
-                        self.strWoe_cal()
-                    elif self.ftrs[i] in ['int', 'float']:
-                        self.woe_cal()
-                    elif isinstance(self.ftrs[i], dict):
-                        self._setStrValue(self.ftrs[i], ifraise = False)
-                        self.woeDetail[i]['str2orders'] = self.ftrs[i]
-                        self.woe_cal()
-
-                    ivs[i] = self.getIVinfo()
+                    stats[i] = binStats(i, self.woeDetail[i]['bins'], str2orders = self.woeDetail[i].get('str2orders'))
+                    stats[i].add(self.data[[i, 'label']])
         except KeyboardInterrupt:
             t.close()
             raise
         t.close()
 
         if vrs is not None:
+            tools.putFile(self.path+'/feature_process_methods/IVstat','binStats_'+vrs+'.json', {k:v.toDict() for k, v in stats.items()})
+
+        return stats
 
+    def AllWoeRefresh(self, stats, vrs = None):
+        """
+        根据各特征的binStats直接更新woeDetail中的WOE编码及IV，分组保持不变，无需原始数据
+        stats：binStats的字典，或者AllBinStats保存的版本号
+        """
+        if not isinstance(stats, dict):
+            stats = tools.getJson(self.path+'/feature_process_methods/IVstat/binStats_'+stats+'.json')
+        stats = {k:(v if isinstance(v, binStats) else binStats(**v)) for k, v in stats.items()}
+
+        ivs = {}
+        for i, v in stats.items():
+            self.woeDetail.setdefault(i, {})
+            self.woeDetail[i]['bins'] = v.bins
+            if v.str2orders is not None:
+                self.woeDetail[i]['str2orders'] = v.str2orders
+            self.woeDetail[i]['woes'] = v.getWoes(self.keepnan)
+            ivs[i] = v.getIVinfo(self.keepnan)
+
+        if vrs is not None:
             tools.putFile(self.path+'/feature_process_methods/IVstat','IVs_'+vrs+'.json', ivs)
             tools.putFile(self.path+'/feature_process_methods/IVstat','woeDetail_'+vrs+'.json', self.woeDetail)
 
-    def AllWoeApl(self, ifsave = True):
+        return ivs
+
+    def _AllWoeCals_parallel(self, n_jobs):
+        ftrs = list(self.ftrs.keys())
+        #切分为多于进程数的连续特征组，平衡各进程的负载
+        n_chunks = min(len(ftrs), n_jobs * 4)
+        chunks = [list(a) for a in np.array_split(np.array(ftrs, dtype = object), n_chunks) if len(a) > 0]
+        params = {'pct_size':self.argms['pct_size'], 'max_grps':self.argms['max_grps'], 'chiq_pv':self.argms['chiq_pv'], \
+                  'ifmono':self.ifmono, 'keepnan':self.keepnan, 'methods':self.methods}
+
+        ivs = {}
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            tasks = [executor.submit(_AllWoeCals_worker, params, self.data[c + ['label']], {i:self.ftrs[i] for i in c}, \
+                                     {i:self.woeDetail[i] for i in c if i in self.woeDetail.keys()}) for c in chunks]
+            try:
+                with tqdm(total = len(ftrs)) as t:
+                    #按提交顺序收集结果，保证与逐个计算时的顺序一致
+                    for c, task in zip(chunks, tasks):
+                        sub_ivs, sub_woeDetail, sub_invalid = task.result()
+                        ivs.update(sub_ivs)
+                        self.woeDetail.update(sub_woeDetail)
+                        self.allInvalid.update(sub_invalid)
+                        t.update(len(c))
+            except KeyboardInterrupt:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        return ivs
+
+    def _AllWoeApl_bulk(self, dtype = np.float64):
+        """
+        一次性预分配(样本数, 特征数)的数组，逐列填入WOE编码，最后只构建一次DataFrame
+        输出与逐特征merge的方式一致
+        """
+        ftrs = list(self.woeDetail.keys())
+        woe_block = np.empty((len(self.data), len(ftrs)), dtype = dtype)
+
+        try:
+            with tqdm(ftrs) as t:
+                for j, i in enumerate(t):
+                    strSet = self.woeDetail[i].get('str2orders')
+                    if strSet is None and isinstance(self.woeDetail[i]['bins'], dict):
+                        #定性特征的编码会剔除空值，按原索引对齐
+                        self.setTgt(self.data[[i, 'label']])
+                        self.strWoe_apply()
+                        woe_block[:, j] = self.getWoeCode()[i].reindex(self.data.index).values
+                    else:
+                        if strSet is None:
+                            vals = self.data[i].values
+                        else:
+                            self.setTgt(self.data[[i, 'label']])
+                            self._setStrValue(strSet, ifraise = False)
+                            vals = self.raw[i].values
+                        woe_block[:, j] = self._woe_codes(vals, self.woeDetail[i]['bins'], self.woeDetail[i]['woes'])
+        except KeyboardInterrupt:
+            t.close()
+            raise
+        t.close()
+
+        data_woe = pd.DataFrame(woe_block, index = self.data.index, columns = ftrs)
+        data_woe.insert(0, 'label', self.data['label'].values)
+        return data_woe
+
+    def AllWoeApl(self, ifsave = True, bulk = False, dtype = np.float64):
+        """
+        bulk：是否使用预分配数组的批量编码方式，特征较多时耗时随特征数线性增长
+        dtype：批量编码时输出数组的精度，可选np.float32以节省内存
+        """
         try:
             if len(set(self.ftrs.keys())-set(self.woeDetail.keys())) > 0:
                 raise ValueError('Run func AllWoeCals first')
@@ -690,26 +1384,29 @@ class AllWoeFuncs(WoeFuncs):
             self.data['label'] = 1
             self.data_woe = self.data[['label']]
 
-        try:
-            with tqdm(self.woeDetail.keys()) as t:
-                for i in t:
-                    #print(i)
-                    strSet = self.woeDetail[i].get('str2orders')
-                    self.setTgt(self.data[[i, 'label']])
-                    if strSet is None:
-                        if isinstance(self.woeDetail[i]['bins'], dict):
-                            self.strWoe_apply()
+        if bulk:
+            self.data_woe = self._AllWoeApl_bulk(dtype)
+        else:
+            try:
+                with tqdm(self.woeDetail.keys()) as t:
+                    for i in t:
+                        #print(i)
+                        strSet = self.woeDetail[i].get('str2orders')
+                        self.setTgt(self.data[[i, 'label']])
+                        if strSet is None:
+                            if isinstance(self.woeDetail[i]['bins'], dict):
+                                self.strWoe_apply()
+                            else:
+                                self.woe_apply()
                         else:
+                            self._setStrValue(strSet, ifraise = False)
                             self.woe_apply()
-                    else:
-                        self._setStrValue(strSet, ifraise = False)
-                        self.woe_apply()
 
-                    self.data_woe = pd.merge(left = self.data_woe, right = self.getWoeCode(), left_index = True, right_index = True, how = 'left')
-        except KeyboardInterrupt:
+                        self.data_woe = pd.merge(left = self.data_woe, right = self.getWoeCode(), left_index = True, right_index = True, how = 'left')
+            except KeyboardInterrupt:
+                t.close()
+                raise
             t.close()
-            raise
-        t.close()
 
         if 'label' not in self.data.columns.values:
             self.data_woe.drop('label', axis = 1, inplace = True)
@@ -14,6 +14,8 @@ path = '../function_test/raw_data'
 basic_check = False
 smy_creation = False
 ftr_stat = False
+#数值型特征的缺失、KS及PSI统计使用FeatureStatTools.ft_stat_batch批量计算，单因子t值使用tvalue_cal_batch
+batch_stat = True
 raw_data_file_name = 'data.csv'
 #检验文件基本属性
 
@@ -75,10 +77,29 @@ if ftr_stat:
     tvs = {i:{} for i in str_col+float_col+int_col}; psis = {i:{} for i in str_col+float_col+int_col}
     mis = {i:{} for i in str_col+float_col+int_col}
     
+    #批量计算过的特征不再逐个计算
+    batch_done = []
+    if batch_stat:
+        print("--------------缺失、KS及PSI批量计算----------------------")
+        batch_done = [i for i in int_col+float_col+toDropList if type_check[i]['type'] != 'str']
+        b_mis, b_kses, b_psis = FeatureStatTools.ft_stat_batch(raw_data[batch_done], raw_data[label], raw_data[dayno]<=dayno_mid, \
+                                                               types = {i:type_check[i]['type'] for i in batch_done}, grps = 10)
+        mis.update(b_mis)
+        kses.update({k:v for k, v in b_kses.items() if k in kses.keys()})
+        psis.update({k:v for k, v in b_psis.items() if k in psis.keys()})
+
+        print("--------------单因子逻辑回归批量计算----------------------")
+        bf_mask = (raw_data[dayno]<=dayno_mid).values
+        b_tvs = {k:FeatureStatTools.tvalue_cal_batch(raw_data[m][batch_done], raw_data[m][label], ifconst = True) for k, m in [('bf', bf_mask), ('af', ~bf_mask)]}
+        for i in batch_done:
+            if i in tvs.keys():
+                #无法拟合时与逐个计算一致记为None
+                tvs[i] = {k:(v.loc[i, 'tvalue'] if v.loc[i, 'converged'] else None) for k, v in b_tvs.items()}
+
     #单因子检验的时候均不考虑缺失值，除非是缺失值的统计
     print("--------------缺失及分布情况简易统计----------------------")
     try:
-        with tqdm(int_col+float_col+str_col+toDropList) as t:
+        with tqdm([i for i in int_col+float_col+str_col+toDropList if i not in batch_done]) as t:
             for i in t:
                 #缺失情况统计
                 mis[i] = FeatureStatTools.ft_mis_check2(raw_data[[i, label]], type_check[i]['type'])[i]
@@ -89,7 +110,7 @@ if ftr_stat:
     
     print("--------------单因子逻辑回归----------------------")
     try:
-        with tqdm(int_col+float_col+str_col) as t:
+        with tqdm([i for i in int_col+float_col+str_col if i not in batch_done]) as t:
             for i in t:
                 df_bf, df_af = raw_data[raw_data[dayno]<=dayno_mid][[i, 'label']], raw_data[raw_data[dayno]>dayno_mid][[i, 'label']]
                 if type_check[i]['type'] != 'str':
@@ -109,7 +130,7 @@ if ftr_stat:
     
     print("--------------KS计算----------------------")
     try:
-        with tqdm(int_col+float_col+str_col) as t:
+        with tqdm([i for i in int_col+float_col+str_col if i not in batch_done]) as t:
             for i in t:
                 df_bf, df_af = raw_data[raw_data[dayno]<=dayno_mid][[i, 'label']], raw_data[raw_data[dayno]>dayno_mid][[i, 'label']]
                 if type_check[i]['type'] != 'str':
@@ -128,7 +149,7 @@ if ftr_stat:
     
     print("--------------PSI计算----------------------")
     try:
-        with tqdm(int_col+float_col+str_col) as t:
+        with tqdm([i for i in int_col+float_col+str_col if i not in batch_done]) as t:
             for i in t:
                 df_bf, df_af = raw_data[raw_data[dayno]<=dayno_mid][[i, 'label']], raw_data[raw_data[dayno]>dayno_mid][[i, 'label']]
                 if type_check[i]['type'] != 'str':
@@ -17,7 +17,7 @@ import model_builder
 import tools
 from WoeMethods import bins_method_funcs
 from FeatureProcess import AllFtrProcess
-from FeatureSelection import ModelBasedMethods
+from FeatureSelection import ModelBasedMethods, corrCache
 
 #设置最基本的路径变量
 level1 = False
@@ -70,7 +70,7 @@ if level1:
     data_m = pbox.transform(data, iflabel = False)
     oot_m = pbox.transform(oot, iflabel = False)
     
-    corr = data_m.corr()
+    corr = corrCache(data_m)
     sbox = ModelBasedMethods(data_m, data_lb, list(data_m.columns.values), corr, params, path)
     #根据iv计算选择特征
     prm_ftrs = sbox.ftr_filter(ivs[['avg']], tgt_c = 0.03, corr_c = 0.6)
@@ -82,7 +82,7 @@ if level1:
     #控制50维特征为最，或者提升的roc不高于0.01
     icr = base
     while len(prm_ftrs) < 50 and icr > 0.01:
-        rlts = sbox.modelIprv_oneStep_plus(prm_ftrs, lftrs, modeltype = 'lr', rnd_seed = 21, mtrc = 'auc', eval_s = 'train')
+        rlts, tvls = sbox.modelIprv_scoreStep_plus(prm_ftrs, lftrs, rnd_seed = 21, mtrc = 'auc', eval_s = 'train')
         tgt_ftr = list(rlts.keys())[0]
         icr = rlts[tgt_ftr] - base
         base = rlts[tgt_ftr]
@@ -104,7 +104,7 @@ if level2:
     data_m = pbox.transform(data, iflabel = False)
     oot_m = pbox.transform(oot, iflabel = False)
     
-    corr = data_m.corr()
+    corr = corrCache(data_m)
     sbox = ModelBasedMethods(data_m, data_lb, list(data_m.columns.values), corr, params, path)
     #根据iv计算选择特征
     prm_ftrs = sbox.ftr_filter(ivs[['avg']], tgt_c = 0.03, corr_c = 0.6)
@@ -116,7 +116,7 @@ if level2:
     #控制50维特征为最，或者提升的roc不高于0.01
     while len(prm_ftrs) > 30 and icr >-0.01:
         #通过累加的方式判断是否需要添加特征
-        rlts = sbox.modelIprv_oneStep_minus(prm_ftrs, modeltype = 'lr', rnd_seed = 21, mtrc = 'auc', eval_s = 'train')
+        rlts = sbox.modelIprv_scoreStep_minus(prm_ftrs, rnd_seed = 21, mtrc = 'auc', eval_s = 'train')
         tgt_ftr = list(rlts.keys())[0]
         icr = rlts[tgt_ftr] - base
         base = rlts[tgt_ftr]
@@ -161,17 +161,15 @@ if level3:
     oot_m = pbox.transform(oot, iflabel = False)
 
     all_ftrs = list(data_m.columns.values)
-    corr = data_m.corr()
+    corr = corrCache(data_m)
     sbox = ModelBasedMethods(data_m, data_lb, list(data_m.columns.values), corr, params, path)
 
-    for i in range(10):
-        #随机抽取10000次样本并建模
-        #this takes time, do remember~
-        features = sbox._random_select_cor(all_ftrs, 50, musthave = None, corr_c = 0.75, rnd_seed = None)
-        sbox.featureStat_model(features, modeltype = 'xgb', rnd_seed = 21)
-        _ = sbox.getTvalues('gain', ifabs = True, name = 'grp_'+str(i))
+    #随机抽取10000次样本并建模
+    #this takes time, do remember~
+    sbox.featureSelection_randomExperiment(runs = 10, nums = 50, modeltype = 'xgb', importance_type = 'gain', \
+                                           rnd_seed = 21, corr_c = 0.75, n_jobs = -1, checkpoint = 'level3_experiments.csv')
 
-    rlts = sbox.featureSelection_AvgScore(top = 30, ftr_c = 0.55)
+    rlts = sbox.featureSelection_AvgScore(top = 30, ftr_c = 0.55, source = 'memory')
     rlts.sort_values('score', ascending =False, inplace = True)
     prm_ftrs = list(rlts.index.values)[:50]
 
@@ -213,7 +211,7 @@ if level4:
     oot_m = pbox.transform(oot, iflabel = False)
 
     all_ftrs = list(data_m.columns.values)
-    corr = data_m.corr()
+    corr = corrCache(data_m)
     sbox = ModelBasedMethods(data_m, data_lb, list(data_m.columns.values), corr, params, path)
 
     features = sbox._random_select_cor(all_ftrs, 200, musthave = None, corr_c = 0.75, rnd_seed = None)
@@ -258,17 +256,14 @@ if level5:
     data_m = pbox.transform(data, iflabel = False)
     all_ftrs = list(data_m.columns.values)
 
-    corr = data_m.corr()
+    corr = corrCache(data_m)
     sbox = ModelBasedMethods(data_m, data_lb, list(data_m.columns.values), corr, params, path)
 
-    for i in range(10):
-        #随机抽取10000次样本并建模
-        #this takes time, do remember~
-        #可以采用多进程优化
-        features = sbox._random_select_cor(all_ftrs, 50, musthave = None, corr_c = 0.75, rnd_seed = None)
-        sbox.featureStat_model(features, modeltype = 'cv', rnd_seed = 21)
-        _ = sbox.getTvalues('gain', ifabs = True, name = 'grp_'+str(i))
+    #随机抽取10000次样本并建模
+    #this takes time, do remember~
+    sbox.featureSelection_randomExperiment(runs = 10, nums = 50, modeltype = 'cv', importance_type = 'gain', \
+                                           rnd_seed = 21, corr_c = 0.75, n_jobs = -1, checkpoint = 'level5_experiments.csv')
 
-    rlts = sbox.featureSelection_AvgScore(top = 30, ftr_c = 0.5)
+    rlts = sbox.featureSelection_AvgScore(top = 30, ftr_c = 0.5, source = 'memory')
     rlts.sort_values('score', ascending =False, inplace = True)
     prm_ftrs = list(rlts.index.values)[:50]
@@ -25,7 +25,7 @@ import model_builder
 import tools
 from WoeMethods import bins_method_funcs, WoeFuncs
 from FeatureProcess import AllFtrProcess
-from FeatureSelection import ModelBasedMethods
+from FeatureSelection import ModelBasedMethods, corrCache
 import model_builder
 import FeatureStatTools
 
@@ -180,7 +180,7 @@ if ifselect:
     data_m = pbox.transform(data, iflabel = False)
     oot_m = pbox.transform(oot, iflabel = False)
     
-    corr = data_m.corr()
+    corr = corrCache(data_m)
     
 if fittingpart:
     print('------------------------------------特征选择---------------------------------------')
@@ -25,7 +25,7 @@ import model_builder
 import tools
 from WoeMethods import bins_method_funcs, WoeFuncs
 from FeatureProcess import AllFtrProcess
-from FeatureSelection import ModelBasedMethods
+from FeatureSelection import ModelBasedMethods, corrCache
 import model_builder
 import FeatureStatTools
 
@@ -179,7 +179,7 @@ if ifselect:
     data_m = pbox.transform(data, iflabel = False)
     oot_m = pbox.transform(oot, iflabel = False)
     
-    corr = data_m.corr()
+    corr = corrCache(data_m)
     
 if fittingpart:
     print('------------------------------------特征选择---------------------------------------')
@@ -194,7 +194,7 @@ if fittingpart:
     #while len(prm_ftrs) < 50 and icr > 0.01:
     while len(prm_ftrs) < 50 and len(lftrs)>0 and icr > 0:
         print('============================round %s============================================='%str(rnd+1))
-        rlts, tvls = sbox.modelIprv_oneStep_plus(prm_ftrs, lftrs, modeltype = 'lr', rnd_seed = 21, mtrc = 'auc', eval_s = 'test', test_size = 0.25)
+        rlts, tvls = sbox.modelIprv_scoreStep_plus(prm_ftrs, lftrs, rnd_seed = 21, mtrc = 'auc', eval_s = 'test', test_size = 0.25)
         rlts = pd.Series(rlts)
         rlts.sort_values(inplace = True, ascending = False)
         tgt_ftr = list(rlts.index.values)[0]
@@ -18,7 +18,10 @@ from xgboost import XGBClassifier
 from sklearn.tree import DecisionTreeClassifier
 
 import statsmodels.api as sm
-from copy import copy
+from scipy import sparse
+import os
+from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import FeatureStatTools as funcs
 import warnings
@@ -28,6 +31,71 @@ from FeatureStatTools import ks_cal_func
 
 #num_rounds = 500
 
+def _sparse_cols(x):
+    """
+    DataFrame中稀疏类型（pd.SparseDtype）的列，非DataFrame返回空列表
+    """
+    if not isinstance(x, pd.DataFrame):
+        return []
+    return [c for c in x.columns if isinstance(x[c].dtype, pd.SparseDtype)]
+
+def _to_dense(x):
+    """
+    将稀疏列转换为普通列，供需要稠密输入的模型（如statsmodels的Logit）使用
+    """
+    cols = _sparse_cols(x)
+    if len(cols) == 0:
+        return x
+    return x.astype({c:x[c].dtype.subtype for c in cols})
+
+def _dmatrix(x, y = None, weight = None, sparse_cols = None):
+    """
+    构建DMatrix：sparse_cols中的列按稀疏方式保存，0不保存，在xgboost中视为缺失；
+    其余列中的0作为实际取值保存，只有空值视为缺失
+    对onehot列而言按缺失值方向分裂与按0/1分裂等价，但同一模型拟合与预测时各列的保存方式必须一致，
+    sparse_cols为None时按x中的稀疏类型（pd.SparseDtype）列确定
+    按列直接构建CSC矩阵（int32行号），避免稠密列转换时的额外拷贝
+    """
+    if sparse_cols is None:
+        sparse_cols = _sparse_cols(x)
+    sparse_cols = set(sparse_cols)
+    #不按稀疏方式保存的稀疏类型列先转换为稠密
+    to_dense = [c for c in _sparse_cols(x) if c not in sparse_cols]
+    if len(to_dense) > 0:
+        x = x.astype({c:x[c].dtype.subtype for c in to_dense})
+    if len(sparse_cols) == 0:
+        return xgb.DMatrix(x, y, weight = weight)
+
+    def _col(c):
+        """
+        返回该列需保存的行号及取值
+        """
+        col = x[c].array
+        if isinstance(x[c].dtype, pd.SparseDtype):
+            return col.sp_index.indices, col.sp_values
+        col = np.asarray(col, dtype = np.float32)
+        keep = ~np.isnan(col)
+        if c in sparse_cols:
+            keep &= col != 0
+        rows = np.flatnonzero(keep).astype(np.int32)
+        return rows, col[rows]
+
+    #每列的行号及取值只计算一次，直接写入按上限（稀疏类型列为保存个数，其余为行数）预分配的数组
+    size = sum(len(x[c].array.sp_values) if isinstance(x[c].dtype, pd.SparseDtype) else len(x) for c in x.columns)
+    indices = np.empty(size, dtype = np.int32)
+    data = np.empty(size, dtype = np.float32)
+    indptr = np.zeros(x.shape[1]+1, dtype = np.int64)
+    for j, c in enumerate(x.columns):
+        rows, vals = _col(c)
+        indptr[j+1] = indptr[j] + len(rows)
+        indices[indptr[j]:indptr[j+1]] = rows
+        data[indptr[j]:indptr[j+1]] = vals
+    indices = indices[:indptr[-1]]
+    data = data[:indptr[-1]]
+
+    mat = sparse.csc_matrix((data, indices, indptr), shape = x.shape)
+    return xgb.DMatrix(mat, y, weight = weight, feature_names = [str(c) for c in x.columns])
+
 class xgbModel(BaseEstimator, ClassifierMixin):
     """
     模型类比较相似，初始化之后会有都函数包括：
@@ -74,16 +142,25 @@ class xgbModel(BaseEstimator, ClassifierMixin):
         return rlt
 
     def fit(self, train, train_label, test, test_label, train_weight = None, test_weight = None):
-        train_data = xgb.DMatrix(train, train_label, weight= train_weight)
-        test_data = xgb.DMatrix(test, test_label, weight= test_weight)
+        sparse_cols = _sparse_cols(train)
+        train_data = _dmatrix(train, train_label, weight= train_weight, sparse_cols = sparse_cols)
+        test_data = _dmatrix(test, test_label, weight= test_weight, sparse_cols = sparse_cols)
+        return self.fit_dmatrix(train_data, train_label, test_data, test_label, list(train.columns.values), sparse_cols)
+
+    def fit_dmatrix(self, train_data, train_label, test_data, test_label, ft_names, sparse_cols = None):
+        """
+        使用已构建好的DMatrix拟合，train_label/test_label用于计算模型表现
+        sparse_cols：DMatrix中按稀疏方式保存（0视为缺失）的列，预测时按相同方式构建DMatrix
+        """
         eval_watch = [(train_data, 'train'), (test_data, 'eval')]
-        self.ft_names = list(train.columns.values)
+        self.ft_names = ft_names
+        self.sparse_ = [] if sparse_cols is None else list(sparse_cols)
 
         xgb_bst=xgb.train({**self.params},train_data, self.num_rounds,\
                           evals=eval_watch, early_stopping_rounds=self.early_stopping_rounds,verbose_eval=False)
         
         train_pred = xgb_bst.predict(train_data)
-        if test is not None:
+        if test_label is not None:
             test_pred = xgb_bst.predict(test_data)
         else:
             test_pred = None
@@ -93,7 +170,8 @@ class xgbModel(BaseEstimator, ClassifierMixin):
         return self
 
     def predict(self, x, y = None):
-        x = xgb.DMatrix(x, y)
+        #与拟合时各列的保存方式保持一致，稀疏/稠密输入均可
+        x = _dmatrix(x, y, sparse_cols = getattr(self, 'sparse_', []))
         return np.array(self.model_.predict(x))
 
     def getTvalues(self, mtrc):
@@ -133,6 +211,10 @@ class lrModel(BaseEstimator, ClassifierMixin):
     def fit(self, train, train_label, test = None, test_label = None, train_weight = None, test_weight = None):
         #self.train = train, self.train_label = train_label, self.test = test, self.test_label = test_label
         self.ft_names = list(train.columns.values)
+        #Logit需要稠密输入，稀疏的onehot列在此转换
+        train = _to_dense(train)
+        if test is not None:
+            test = _to_dense(test)
 
         if self.ifconst:
             x = sm.add_constant(train)
@@ -162,6 +244,7 @@ class lrModel(BaseEstimator, ClassifierMixin):
         return self
 
     def predict(self, x, y = None):
+        x = _to_dense(x)
         if self.ifconst:
             x = sm.add_constant(x)
         return np.array(self.model_.predict(x))
@@ -175,7 +258,18 @@ class lrModel(BaseEstimator, ClassifierMixin):
     def getMperfrm(self):
         return self.Mperfrm
 
+def _cv_fold_worker(model, sub_train, sub_train_label, sub_test, sub_test_label, sub_train_weight, sub_test_weight):
+    """
+    cvModel多进程模式的子进程任务：在一折数据上拟合该折独立的模型
+    """
+    return model.fit(sub_train, sub_train_label, sub_test, sub_test_label, sub_train_weight, sub_test_weight)
+
 class cvModel(BaseEstimator, ClassifierMixin):
+    """
+    params中可选：
+    n_jobs：各折并行拟合的进程数，None或1时逐折拟合，-1时使用全部CPU
+    nthread：内部为xgboost时所有折合计使用的线程数上限，各折平均分配
+    """
     def __init__(self, params = {'modeltype':'lr', 'kfold':5, 'params':{}}):
         if params['modeltype'] == 'lr':
             model = lrModel(params['params'])
@@ -187,6 +281,8 @@ class cvModel(BaseEstimator, ClassifierMixin):
         self.model_ = model
         self.kfolds = params['kfold']
         self.params = params['params']
+        self.n_jobs = params.get('n_jobs', None)
+        self.nthread = params.get('nthread', None)
 
     def setParams(self, params):
         try:
@@ -195,9 +291,21 @@ class cvModel(BaseEstimator, ClassifierMixin):
         except:
             raise ValueError('Invalid Parameters')
 
+    def _fold_model(self, n_jobs):
+        #每一折使用独立的模型实例，xgboost的线程数按并行的折数分配
+        model = deepcopy(self.model_)
+        if self.nthread is not None and isinstance(model, xgbModel):
+            model.params['nthread'] = max(1, self.nthread // n_jobs)
+        return model
+
     def fit(self, train, train_label, test = None, test_label = None, train_weight = None, test_weight = None):
+        n_jobs = self.n_jobs
+        if n_jobs is not None and n_jobs < 0:
+            n_jobs = os.cpu_count()
+        n_jobs = 1 if n_jobs is None else min(n_jobs, self.kfolds)
+
         kfolds = KFold(n_splits=self.kfolds,shuffle=True).split(train)
-        models = []
+        folds = []
         for train_index, test_index in kfolds:
             sub_train = train.iloc[train_index]; sub_test = train.iloc[test_index]
             sub_train_label = train_label.iloc[train_index]; sub_test_label = train_label.iloc[test_index]
@@ -205,39 +313,43 @@ class cvModel(BaseEstimator, ClassifierMixin):
                 sub_train_weight = train_weight.iloc[train_index]; sub_test_weight = train_weight.iloc[test_index]
             else:
                 sub_train_weight = None; sub_test_weight = None
+            folds += [(sub_train, sub_train_label, sub_test, sub_test_label, sub_train_weight, sub_test_weight)]
 
-            models += [copy(self.model_.fit(sub_train, sub_train_label, sub_test, sub_test_label, sub_train_weight, sub_test_weight))]
+        if n_jobs <= 1:
+            models = [self._fold_model(1).fit(*f) for f in folds]
+        else:
+            with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+                tasks = [executor.submit(_cv_fold_worker, self._fold_model(n_jobs), *f) for f in folds]
+                models = [task.result() for task in tasks]
 
         self.models = models
         self.ft_names = list(train.columns.values)
         self.Mperfrm = self.getMperfrm()
         return self
 
-    def predict(self, x, y = None):
+    def predict(self, x, y = None, n_jobs = None):
         """
         this function returns the average prediction of all saved models!
         could be same bias when used to predict trainning sample
+        n_jobs：各折模型并行预测的线程数，None或1时逐个预测，此时只占用一个结果数组，与折数无关
+        结果按折的顺序累加
         """
         warnings.warn("""this function returns the average prediction of all functions!
                          could be same bias when used to predict trainning samples""")
-        for m in range(len(self.models)):
-            if m == 0:
-                df = pd.DataFrame(self.models[m].predict(x,y), columns = ['model_'+str(m)])
-            else:
-                tmp = pd.DataFrame(self.models[m].predict(x,y), columns = ['model_'+str(m)])
-                df = pd.merge(left = df, right = tmp, left_index = True, right_index = True, how = 'outer')
-
+        pred = np.zeros(len(x))
+        if n_jobs is None or n_jobs == 1:
+            for m in self.models:
+                pred += m.predict(x, y)
+        else:
+            with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+                tasks = [executor.submit(m.predict, x, y) for m in self.models]
+                for task in tasks:
+                    pred += task.result()
 
-        return np.array(df.mean(axis=1))
+        return pred / len(self.models)
 
     def getTvalues(self, mtc = None):
-        for m in range(len(self.models)):
-            if m == 0:
-                df = pd.DataFrame(self.models[m].getTvalues(mtc), columns = ['model_'+str(m)])
-            else:
-                tmp = pd.DataFrame(self.models[m].getTvalues(mtc), columns = ['model_'+str(m)])
-                df = pd.merge(left = df, right = tmp, left_index = True, right_index = True, how = 'outer')
-
+        df = pd.concat([pd.Series(m.getTvalues(mtc)).rename('model_'+str(i)) for i, m in enumerate(self.models)], axis = 1, sort = True)
         df = df.fillna(0)
         return df
         #return df.mean(axis = 1)
@@ -251,34 +363,21 @@ class cvModel(BaseEstimator, ClassifierMixin):
         return {'train':train.mean().to_dict(), 'test':test.mean().to_dict(), 'train_std':train.std().to_dict(), 'test_std':test.std().to_dict()}
 
 class trAdaboostMethods(BaseEstimator, ClassifierMixin):
-    def __init__(self, n_estimators = 100, max_depth = 2, min_samples_split = 2, random_state = None):
+    """
+    TrAdaBoost迁移学习：训练数据中if_same_dist为1的是目标分布样本，为0的是源分布样本
+    每轮用当前权重拟合一棵决策树，源样本错分时降权，目标样本错分时升权
+    权重、各轮预测均以numpy数组保存并向量化更新，
+    最终模型为后一半（第ceil(N/2)到N轮）的分类器按-log(beta_t)加权投票
+    early_stopping_rounds：不为None且fit时提供test/test_label（目标分布）时按其AUC提前停止，只保留最优的轮数；
+    为None时保留全部n_estimators轮
+    """
+    def __init__(self, n_estimators = 100, max_depth = 2, min_samples_split = 2, random_state = None, early_stopping_rounds = None):
         self.n_estimators = n_estimators
-        self.max_depth = 2
-        self.min_samples_split = 2
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
         self.random_state = random_state
-    
-    def _calculateP(self, weights):
-        total = weights.sum()
-        return weights / total
-    
-    def _estimator(self, trans_data, trans_label, test_data, p):
-        clf = DecisionTreeClassifier(criterion="gini", max_features="log2", splitter="random", \
-                                     max_depth = self.max_depth, min_samples_split = self.min_samples_split, random_state = self.random_state)
-        clf.fit(trans_data, trans_label, sample_weight=p)
-        return clf.predict(test_data)
-    
-    def _errorRate(self, label_R, label_H, weight):
-        total = np.sum(weight)
-        return np.sum(weight[:, 0] / total * np.abs(label_R - label_H))
-    
-    def _smlSum(self, alist):
-        
-        rlts = alist[0]
-        for i in alist[1:]:
-            rlts += alist[i]
-            
-        return rlts
-    
+        self.early_stopping_rounds = early_stopping_rounds
+
     def _model_perform_funcs(self, ylabel, ypred):
         rlt = {}
         if ylabel is not None and ypred is not None:
@@ -290,53 +389,105 @@ class trAdaboostMethods(BaseEstimator, ClassifierMixin):
             rlt['apr'] = None
             rlt['logloss'] = None
         return rlt
-    
+
+    def _estimator(self, x, label, p, rnd):
+        clf = DecisionTreeClassifier(max_depth = self.max_depth, min_samples_split = self.min_samples_split, random_state = rnd)
+        clf.fit(x, label, sample_weight = p)
+        return clf
+
+    def _tree_proba(self, clf, x):
+        #只有一个类别时predict_proba只有一列
+        proba = clf.predict_proba(x)
+        if proba.shape[1] == 1:
+            return np.full(len(x), float(clf.classes_[0]))
+        return proba[:, 1]
+
     def fit(self, train, train_label, test = None, test_label = None):
         """
         a specific indicator is required suggesting sample distribution
         """
-        h_list = []
+        same = train['if_same_dist'].values == 1
+        x = np.asarray(train.drop('if_same_dist', axis = 1).values, dtype = np.float32)
+        y = np.asarray(train_label, dtype = int)
+        n_diff = (~same).sum()
+        rng = np.random.RandomState(self.random_state)
+
+        weights = np.ones(len(x))/len(x)
+        beta = 1/(1+np.sqrt(2*np.log(max(n_diff, 1))/self.n_estimators))
+        ifeval = test is not None and test_label is not None
+        ifstop = ifeval and self.early_stopping_rounds is not None
+        if ifstop:
+            x_test = np.asarray(test.drop('if_same_dist', axis = 1, errors = 'ignore').values, dtype = np.float32)
+            #cum_test为全部轮次加权预测的累计和，cum_lo为前lo轮的累计和，两者之差即后一半分类器的集成结果
+            cum_test = np.zeros(len(x_test)); cum_lo = np.zeros(len(x_test)); cum_alpha = [0.0]; lo = 0
+            best_auc = -np.inf; best_iter = 0
+
+        models = []
         beta_ts = []
-        s_index = train[train['if_same_dist'] == 1].index
-        d_index = train[train['if_same_dist'] == 0].index
-        train = train.drop('if_same_dist', axis = 1)
-        
-        weights = pd.Series(np.ones([len(train)])/len(train), index = train.index)
-        beta = 1/(1+np.sqrt(2*np.log(len(d_index)/self.n_estimators)))
-        
         for i in range(self.n_estimators):
-            p = self._calculateP(weights)
-            
-            clf = DecisionTreeClassifier(max_depth = self.max_depth, min_samples_split = self.min_samples_split, random_state = self.random_state)
-            clf.fit(train, train_label, sample_weight=p)
-            pred = pd.Series(clf.predict(train), idnex = train.index)
-            
-            es = self._errorRate(pred.loc[s_index], train_label.loc[s_index], weights.loc[s_index])
+            p = weights/weights.sum()
+            clf = self._estimator(x, y, p, rng.randint(np.iinfo(np.int32).max))
+            miss = clf.predict(x) != y
+
+            es = np.dot(p[same], miss[same])/p[same].sum()
             if es > 0.5:
                 warnings.warn('error rates too high, may not converge!')
                 es = 0.5
-            
+            es = max(es, 1e-10)
             beta_t = es/(1-es)
-                
-            w_s = weights.loc[s_index] * (pred-train_label).loc[s_index].apply(np.abs).apply(lambda x: np.power(beta_t, (-x)))
-            w_d = weights.loc[d_index] * (pred-train_label).loc[d_index].apply(np.abs).apply(lambda x: np.power(beta,x))
-            weights = pd.concat([w_s, w_d])
-            h_list += [clf]
+
+            #源样本错分时乘beta降权，目标样本错分时乘1/beta_t升权
+            weights = np.where(miss, np.where(same, weights/beta_t, weights*beta), weights)
+            weights /= weights.sum()
+            models += [clf]
             beta_ts += [beta_t]
-            
-        self.models = h_list
-        self.beta_ts = beta_ts
-        
+
+            if ifstop:
+                alpha = -np.log(beta_t)
+                cum_test += alpha*self._tree_proba(clf, x_test); cum_alpha += [cum_alpha[-1] + alpha]
+                #lo每两轮后移一位，移出的分类器重新预测一次计入cum_lo，不保存各轮的累计结果
+                while lo < int(np.ceil((i+1)/2.0)) - 1:
+                    cum_lo += -np.log(beta_ts[lo])*self._tree_proba(models[lo], x_test)
+                    lo += 1
+                ctrs = cum_alpha[i+1] - cum_alpha[lo]
+                pred = (cum_test - cum_lo)/ctrs if ctrs > 0 else np.full(len(x_test), 0.5)
+                auc = metrics.roc_auc_score(test_label, pred)
+                if auc > best_auc:
+                    best_auc = auc; best_iter = i+1
+                elif i+1-best_iter >= self.early_stopping_rounds:
+                    break
+
+        self.best_iteration = best_iter if ifstop else len(models)
+        self.models = models[:self.best_iteration]
+        self.beta_ts = np.array(beta_ts[:self.best_iteration])
+
+        train_pred = self.predict_proba(train.drop('if_same_dist', axis = 1))[:, 1]
+        test_pred = self.predict_proba(test.drop('if_same_dist', axis = 1, errors = 'ignore'))[:, 1] if ifeval else None
+        self.Mperfrm = {'train':self._model_perform_funcs(train_label, train_pred), 'test':self._model_perform_funcs(test_label, test_pred)}
+
         return self
-    
+
+    def _vote(self, x, ifproba):
+        x = np.asarray(x, dtype = np.float32)
+        lo = int(np.ceil(len(self.models)/2.0)) - 1
+        alphas = -np.log(self.beta_ts[lo:])
+        pred = np.zeros(len(x))
+        for a, clf in zip(alphas, self.models[lo:]):
+            pred += a*(self._tree_proba(clf, x) if ifproba else clf.predict(x))
+        return pred, alphas.sum()
+
     def predict(self, x, y = None):
-        pred = self._smlSum([-self.models[i].predict(x) * np.log(self.beta_ts[i]) for i in range(np.int(np.ceil(self.n_estimators/2)), self.n_estimators+1)])
-        ctrs = np.sum([-0.5 * np.log(self.beta_ts[i]) for i in range(np.int(np.ceil(self.n_estimators/2)), self.n_estimators+1)])
-            
-        rlts = (pred>=ctrs).apply(np.int)
-        
-        return rlts
-    
+        pred, ctrs = self._vote(x, False)
+        return (pred >= 0.5*ctrs).astype(int)
+
+    def predict_proba(self, x, y = None):
+        """
+        后一半分类器按-log(beta_t)加权的平均概率
+        """
+        pred, ctrs = self._vote(x, True)
+        pred = pred/ctrs if ctrs > 0 else np.full(len(pred), 0.5)
+        return np.vstack([1-pred, pred]).T
+
     def getTvalues(self, mtc = None):
         pass
 
@@ -344,15 +495,4 @@ class trAdaboostMethods(BaseEstimator, ClassifierMixin):
         pass
 
     def getMperfrm(self):
-        pass
-            
-            
-                
-            
-                
-        
-        
-        
-        
-    
-    
\ No newline at end of file
+        return self.Mperfrm
@@ -0,0 +1,142 @@
+import pandas as pd
+import numpy as np
+import time
+
+from WoeMethods import WoeFuncs
+import FeatureStatTools
+from model_builder import trAdaboostMethods
+
+"""
+性能对比脚本，打开对应的开关运行
+"""
+smp_size_check = True
+ks_cal = True
+tradaboost = True
+
+rnd_seed = 21
+
+def timeit(func, *args, **kwargs):
+    t = time.time()
+    rlt = func(*args, **kwargs)
+    return rlt, time.time() - t
+
+def smpSizeCheck_legacy(ft_name, tmp, prm_cuts, smp_size):
+    """
+    原有的_smpSizeCheck_real：每次合并后重新pd.cut并groupby
+    """
+    tmp['grp'] = pd.cut(tmp[ft_name], bins = prm_cuts, labels = range(len(prm_cuts)-1), right = False)
+    stat = tmp[['grp', ft_name]].groupby('grp', as_index = True).count()
+
+    while stat[ft_name].min() < smp_size:
+        tgt_loc = np.argmin(stat[ft_name])
+        if tgt_loc == 0:
+            prm_cuts.remove(prm_cuts[tgt_loc+1])
+        elif tgt_loc == len(prm_cuts)-2:
+            prm_cuts.remove(prm_cuts[tgt_loc-1])
+        elif stat.loc[tgt_loc-1,ft_name] < stat.loc[tgt_loc+1, ft_name]:
+            prm_cuts.remove(prm_cuts[tgt_loc])
+        else:
+            prm_cuts.remove(prm_cuts[tgt_loc+1])
+
+        tmp = tmp.assign(grp=pd.cut(tmp[ft_name], bins = prm_cuts, labels = range(len(prm_cuts)-1), right = False))
+        stat = tmp[['grp', ft_name]].groupby('grp', as_index = True).count()
+
+    return prm_cuts
+
+def ks_cal_legacy(df, grps=10, ascd = False, duplicates = 'drop'):
+    """
+    原有的ks_cal_func：排序后qcut并groupby统计
+    """
+    ft_name, _ = df.columns.values
+    df = df.dropna()
+
+    df.sort_values(by = ft_name, ascending = ascd, inplace = True)
+    df['grps'] = pd.qcut(df[ft_name], q = grps, duplicates = duplicates)
+
+    stat = df.groupby('grps', as_index = False).agg({ft_name:['min', 'max'], 'label':['count', 'sum']})
+    stat.columns = ['grps', 'min_ft', 'max_ft', 'size', 'bad_cnt']
+    stat.sort_values('grps', ascending = ascd, inplace = True)
+
+    stat['good_cnt'] = stat['size'] - stat['bad_cnt']
+    stat['good_cumsum'] = stat['good_cnt'].cumsum()
+    stat['bad_cumsum'] = stat['bad_cnt'].cumsum()
+
+    stat['bad_pct'] = stat['bad_cnt']/stat['size']
+    stat['bad_cumsum_pct'] = stat['bad_cumsum']/df['label'].sum()
+    stat['good_cumsum_pct'] = stat['good_cumsum']/(len(df)-df['label'].sum())
+
+    stat['ks'] = (stat['bad_cumsum_pct'] - stat['good_cumsum_pct'])
+    return stat
+
+if smp_size_check:
+    print("--------------_smpSizeCheck_real: 分组数及样本量----------------------")
+    rng = np.random.RandomState(rnd_seed)
+    rlts = []
+    for rows in [10**4, 10**5, 10**6]:
+        x = rng.lognormal(size = rows)
+        tmp = pd.DataFrame({'ft':x, 'label':(rng.rand(rows) < 0.1).astype(int)})
+        spurs = WoeFuncs()
+        spurs.setTgt(tmp)
+        #排序数组只在setTgt后构建一次，单独计时
+        _, prep_t = timeit(spurs._getPrep)
+        for grps in [10, 40, 160]:
+            #分组的初始样本数不均匀，保证有足够多的合并次数，最后一组保留较多样本
+            cuts = list(np.unique(np.quantile(x, [0] + list(np.sort(rng.rand(grps-1)*0.8))))) + [x.max()+1]
+            smp_size = np.int(rows*0.05)+1
+
+            new_cuts, new_t = timeit(spurs._smpSizeCheck_real, cuts[:], smp_size)
+            old_cuts, old_t = timeit(smpSizeCheck_legacy, 'ft', tmp.copy(), cuts[:], smp_size)
+            if new_cuts != old_cuts:
+                raise ValueError('results not match!')
+            rlts += [[rows, len(cuts)-1, len(new_cuts)-1, old_t, prep_t, new_t, old_t/(prep_t+new_t)]]
+
+    print(pd.DataFrame(rlts, columns = ['rows', 'grps', 'final_grps', 'legacy_sec', 'prep_sec', 'count_sec', 'speedup']))
+
+if ks_cal:
+    print("--------------ks_cal_func: 样本量----------------------")
+    rng = np.random.RandomState(rnd_seed)
+    rlts = []
+    for rows in [10**4, 10**5, 10**6]:
+        label = (rng.rand(rows) < 0.1).astype(int)
+        #模拟模型预测概率，坏样本得分偏高
+        prd = 1/(1+np.exp(-(rng.normal(size = rows) + label - 2)))
+        df = pd.DataFrame({'prd':prd, 'label':label})
+
+        old_stat, old_t = timeit(ks_cal_legacy, df.copy(), 10)
+        new_stat, new_t = timeit(FeatureStatTools.ks_cal_func, df.copy(), 10)
+        (ks_max, _), arr_t = timeit(FeatureStatTools.ks_cal_array, prd, label, 10)
+        if not np.allclose(old_stat['ks'].values, new_stat['ks'].values):
+            raise ValueError('results not match!')
+        rlts += [[rows, old_stat['ks'].abs().max(), ks_max, old_t, new_t, arr_t, old_t/new_t, old_t/arr_t]]
+
+    print(pd.DataFrame(rlts, columns = ['rows', 'ks_decile', 'ks_exact', 'legacy_sec', 'frame_sec', 'array_sec', 'frame_speedup', 'array_speedup']))
+
+if tradaboost:
+    print("--------------trAdaboostMethods: 每轮耗时----------------------")
+
+    class trAdaboostTimed(trAdaboostMethods):
+        #单独统计决策树拟合及预测的耗时，其余为权重更新等
+        def _estimator(self, x, label, p, rnd):
+            t = time.time()
+            clf = super(trAdaboostTimed, self)._estimator(x, label, p, rnd)
+            clf.predict(x)
+            self.tree_sec += time.time() - t
+            return clf
+
+    rng = np.random.RandomState(rnd_seed)
+    rlts = []
+    for src, tgt in [(10**5, 10**4), (10**6, 10**5)]:
+        x = pd.DataFrame(rng.normal(size = (src+tgt, 10)), columns = ['ft_'+str(i) for i in range(10)])
+        x.iloc[src:] += 0.3
+        label = pd.Series((rng.rand(src+tgt) < 1/(1+np.exp(-(x['ft_0']+x['ft_1']-2)))).astype(int))
+        x['if_same_dist'] = np.r_[np.zeros(src), np.ones(tgt)]
+
+        spurs = trAdaboostTimed(n_estimators = 10, max_depth = 3, random_state = rnd_seed)
+        spurs.tree_sec = 0
+        _, fit_t = timeit(spurs.fit, x, label)
+        #fit最后对训练集的一次predict_proba不属于每轮的计算
+        _, pred_t = timeit(spurs.predict_proba, x.drop('if_same_dist', axis = 1))
+        rounds = len(spurs.models)
+        rlts += [[src, tgt, rounds, (fit_t-pred_t)/rounds, spurs.tree_sec/rounds, spurs.tree_sec/(fit_t-pred_t)]]
+
+    print(pd.DataFrame(rlts, columns = ['source', 'target', 'rounds', 'round_sec', 'tree_sec', 'tree_share']))
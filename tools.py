@@ -48,4 +48,18 @@ def card_score(pred, P = 660, Q = 20, PDO = 50, good_weight = 1):
     Odds = (1-pred)*good_weight/pred
     B = -PDO/np.log(2)
     A = P + B*np.log(Q)
-    return A - B*np.log(Odds)
\ No newline at end of file
+    return A - B*np.log(Odds)
+
+def dict_map(s, d, default = None):
+    """
+    按字典映射Series，不在字典中的取值（包括空值）为default，
+    等价于s.apply(lambda x: d[x] if x in d.keys() else default)
+    先factorize得到各类别的位置，再由类别对应的查找表一次取值
+    """
+    codes, uniques = pd.factorize(s)
+    table = [d[x] if x in d.keys() else default for x in uniques]
+    #factorize中空值的位置为-1，对应查找表的最后一位
+    if (codes < 0).any():
+        table += [default]
+    table = pd.Series(table, dtype = object).infer_objects() if len(table) > 0 else pd.Series([], dtype = float)
+    return pd.Series(table.values[codes], index = s.index, name = s.name)